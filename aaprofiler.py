@@ -24,50 +24,148 @@
  - inventory sources
  - teams
  - users
+ - jobs and workflow jobs
 
  Each object will have its own csv file generated under the 'results_XXX' where XXX is the fqdn of the controller
  Also, a log file named 'extraction.log' is created under the same results directory
+
+ Usage :
+   ./aaprofiler.py --controller-fqdn controller.example.com --controller-user admin --resources-to-extract hosts,roles
+   ./aaprofiler.py --help
+
+ Or as a library :
+   from aaprofiler import Profiler
+   Profiler(controller_fqdn='controller.example.com', controller_user='admin', controller_pass='...').run()
 '''
 
 import os
+import io
 import sys
 import re
+import json
+import heapq
+import hashlib
+import zipfile
+import argparse
 import requests
 import socket
+import threading
+import contextvars
+import queue
+import logging
+import logging.handlers
+import time
+import random
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED, as_completed
 from contextlib import closing
-from datetime import datetime
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
 
 requests.packages.urllib3.disable_warnings()
 
-# -------------------------------------------- EDIT ONLY THIS BLOCK !! --------------------------------------------
-controller_fqdn = 'controller.example.com'
-controller_user = 'admin'
-controller_pass = '**********'
-controller_port = 443
-
-# Set the API return page object count, should be between 1 and 200.
-page_size = 200
-
-# You can extract Everything :
-# resources_to_extract = ['host_metrics', 'credentials', 'projects', 'hosts', 'job_templates', 'inventories', 'inventory_sources', 'users', 'teams',  'roles', 'workflow_job_templates']
-
-# OR You can choose a subset to extract :
-# resources_to_extract = ['credentials', 'projects', 'job_templates', 'inventories', 'inventory_sources', 'users', 'teams', 'workflow_job_templates']
-
-# Set this to 'True' to fetch Org names instead of Org ID when extracting hosts
-# !! Warning setting this to 'True' makes the extraction much slower (depending on how many hosts you have) !!
-get_hosts_org_name = False
-
-# -------------------------------------------------------------------------------------------------------------------
-
-# -------------------------------------------- DO NOT EDIT ANYTHING BELOW THIS LINE ! -------------------------------
-
-def extract_inventory_sources(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + ' ...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+all_possible_resources = ['credentials', 'projects', 'hosts', 'job_templates', 'inventories', 'inventory_sources', 'users', 'teams',  'roles', 'workflow_job_templates', 'host_metrics', 'jobs', 'workflow_jobs']
+
+# Every option of the profiler with its default value and description.
+# Options are given to Profiler() as keyword arguments or a dict, or on the command line (--page-size 100)
+# and in the environment (AAPROFILER_PAGE_SIZE=100) when the script is run.
+OPTIONS = [
+    ('controller_fqdn', '', 'AWX or AAP Controller hostname or IP (or CONTROLLER_HOST)'),
+    ('controller_user', 'admin', 'AWX or AAP username (or CONTROLLER_USERNAME)'),
+    ('controller_pass', '', 'AWX or AAP password (or CONTROLLER_PASSWORD)'),
+    ('controller_port', 443, 'Controller API port'),
+    ('controller_token', '', 'Pre-issued OAuth2 / personal access token used instead of the password, never revoked by the script '
+                             '(or CONTROLLER_OAUTH_TOKEN)'),
+    ('resources_to_extract', ['credentials', 'projects', 'hosts', 'job_templates', 'roles', 'inventories'],
+     'Comma separated list of the resources to extract, among : ' + ', '.join(all_possible_resources)),
+    ('results_dir', '', "Directory of the csv files and logs, 'results_<controller fqdn>' by default"),
+    ('page_size', 200, 'API page object count, between 1 and 200'),
+    ('pagination_mode', 'page', "'page' uses ?page=N (an OFFSET query on the controller database). 'keyset' orders every listing "
+                                "by ID and starts each page after the last ID of the previous one (?id__gt=<last id>) : "
+                                "per page latency stays flat and objects changed during the run are neither skipped nor duplicated"),
+    ('get_hosts_org_name', True, 'Fetch Org names instead of Org IDs when extracting hosts (resolved from a lookup table loaded once)'),
+    ('hosts_strategy', 'pages', "'pages' lists /api/v2/hosts page by page, 'script' pulls every inventory in one call from "
+                                "/api/v2/inventories/<id>/script/?hostvars=1 (much faster for big inventories)"),
+    ('hosts_script_workers', 2, "Number of inventories pulled at the same time with the 'script' hosts strategy"),
+    ('use_token_auth', False, 'Create an OAuth2 token at startup and use it (Bearer header) for the rest of the run instead of '
+                              'Basic auth on every call. The token is revoked when the run ends'),
+    ('incremental', False, 'Only fetch the objects modified since the previous run (modified__gt) and merge them by ID into the '
+                           'previous csv files. Applies to credentials, projects, hosts, job_templates and workflow_job_templates'),
+    ('change_capture', False, 'Keep projects, credentials, job_templates, teams, users and roles up to date from the activity '
+                              'stream : only the objects touched since the previous run are re-fetched'),
+    ('resume', False, 'Continue an interrupted extraction : finished resources are skipped and a partially extracted resource '
+                      'continues after its last saved page, without duplicate rows'),
+    ('min_requests_in_flight', 1, 'Lower bound of the adaptive number of API requests in flight'),
+    ('max_requests_in_flight', 8, 'Upper bound of the adaptive number of API requests in flight'),
+    ('target_latency', 2.0, 'Controller latency (seconds) above which the number of requests in flight is halved'),
+    ('connect_timeout', 10, 'Connect timeout (seconds) of every API request'),
+    ('read_timeout', 120, 'Read timeout (seconds) of every API request'),
+    ('max_retries', 5, 'Failed requests (connection errors, timeouts, 5xx, 429, invalid JSON) are retried with a jittered '
+                       'exponential backoff'),
+    ('circuit_breaker_threshold', 5, 'Consecutive failures after which an endpoint family is paused'),
+    ('circuit_breaker_cooldown', 60, 'Pause (seconds) of an endpoint family whose circuit breaker is open'),
+    ('capture_mode', None, "'record' saves every raw API response in a compressed archive, 'replay' runs the extraction against "
+                           "that archive without any network access (use the same settings as the recording run)"),
+    ('capture_file', '', "Path of the capture archive, 'api_capture.zip' in the results directory by default"),
+    ('http_pool_size', 10, 'Number of keep-alive connections kept open to the controller, keep it greater than or equal to the '
+                           'biggest number of page workers'),
+    ('resource_workers', 4, 'Number of resources (and lookup tables) extracted at the same time. Resources only wait for the '
+                            'lookup tables they use, all of them share the max_requests_in_flight budget'),
+    ('jobs_partition_size', 10000, 'Size of the ID ranges the jobs and workflow_jobs history is split in, the ranges are '
+                                   'scanned in parallel by the page workers'),
+    ('jobs_aggregates', False, 'Also write jobs_by_template.csv and workflow_jobs_by_template.csv (runs, failures, durations '
+                               'per template), computed while the jobs are extracted'),
+    ('log_level', 'info', "'info' logs the progress of every resource, 'debug' also every page and object (role, user, team, "
+                          "inventory...), 'warning' only the warnings"),
+    ('progress_interval', 10.0, 'Minimum number of seconds between two progress lines (rows/s and ETA) of a resource'),
+    ('estimate_samples', 10, 'Number of parent objects whose sub-collections (users of a role, roles of a team...) are sampled '
+                             'by --estimate'),
+    ('resource_filters', {}, 'Extra API filters per resource, e.g. hosts=organization__name=Default. Resources extracted as a '
+                             'whole (roles, inventory_sources, hosts with the script strategy) are not filtered'),
+    ('default_page_workers', 1, "Number of pages fetched and parsed at the same time for resources not listed in page_workers"),
+    ('page_workers', {'hosts': 4, 'host_metrics': 4, 'users': 4, 'teams': 4, 'roles': 4, 'inventories': 4, 'jobs': 4, 'workflow_jobs': 4},
+     'Number of pages fetched and parsed at the same time per resource, e.g. hosts=4,roles=2. Rows are always written in page order'),
+]
+DEFAULT_CONFIG = {name: default for name, default, description in OPTIONS}
+
+
+class ProfilerError(Exception):
+    # Invalid configuration or unreachable controller. The code is the exit status of the command line.
+    def __init__(self, message, code):
+        super(ProfilerError, self).__init__(message)
+        self.code = code
+
+
+class ExtractionStopped(Exception):
+    # Raised in the threads still working for a run that is stopping (an error in another resource, or Ctrl-C)
+    pass
+
+
+# Registry of the resource extractors, filled by the @resource_extractor decorator :
+#  - 'header' : first line of the csv file
+#  - 'page'   : extractor(profiler, file, page_n) writing the rows of one page of /api/v2/<resource>
+#  - 'bulk'   : extractor(profiler, file) writing all the rows of the resource at once, used instead of the pages
+#  - 'lookups' : shared lookup tables used by the extractors, loaded before the resource is scheduled
+#  - 'partitioned' : the listing is split in ID ranges fetched in parallel instead of pages
+extractors = dict()
+
+
+def resource_extractor(resource, header=None, bulk=False, lookups=(), partitioned=False):
+    def register(func):
+        entry = extractors.setdefault(resource, {'lookups': list(), 'partitioned': False})
+        if header:
+            entry['header'] = header
+        entry['partitioned'] = entry['partitioned'] or partitioned
+        entry['bulk' if bulk else 'page'] = func
+        entry['lookups'] += [name for name in lookups if name not in entry['lookups']]
+        return func
+    return register
+
+
+def extract_inventory_sources(profiler, file, page_n):
     for source in page_n['results']:
         source_name = source['name']
         source_type = source['source']
@@ -88,12 +186,15 @@ def extract_inventory_sources(file, n):
         file.write(result + "\n")
 
 
-def extract_teams(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('inventory_sources', 'Organization;Source Name;Source Type;Parent Inventory;Source Project;Source Credentials', bulk=True,
+                    lookups=['inventory_sources'])
+def extract_all_inventory_sources(profiler, file):
+    # Sources are listed once and shared with the inventories extraction
+    extract_inventory_sources(profiler, file, {'results': profiler.get_lookup('inventory_sources')})
+
 
+@resource_extractor('teams', 'Team ID;Team Name;Organization;Users', lookups=['memberships'])
+def extract_teams(profiler, file, page_n):
     for team in page_n['results']:
         # Get Hostname
         team_id = team['id']
@@ -101,43 +202,22 @@ def extract_teams(file, n):
         team_org = team['summary_fields']['organization']['name']
 
         # Get teams users
-        team_users = ['']
-        r = requests.get(
-            controller_host + '/api/v2/teams/' + str(team_id) + '/users?page=1&page_size=' + str(page_size),
-            auth=(controller_user, controller_pass), verify=False)
-        team_users_page1 = r.json()
-        team_users_count = team_users_page1['count']
-        team_users_pages_count = team_users_count // page_size + bool(team_users_count % page_size)
-
-        if team_users_count > 0:
-            print('+++ Team ' + str(team_id) + ' has ' + str(
-                team_users_count) + ' user(s). Extracting it from ' + str(
-                team_users_pages_count) + ' page(s).')
-            for user_team_page_n in range(1, team_users_pages_count + 1):
-                user_team_list_raw = requests.get(
-                    controller_host + '/api/v2/teams/' + str(team_id) + '/users?page=' + str(
-                        user_team_page_n) + '&page_size=' + str(
-                        page_size), auth=(controller_user, controller_pass), verify=False)
-                user_team_list = user_team_list_raw.json()
-                if user_team_list['results']:
-                    for t in user_team_list['results']:
-                        team_users.append(t['username'])
-
-        # Removing empty first element
-        if len(team_users) > 1 and team_users[0] == '':
-            del team_users[0]
+        team_users_index = dict() if profiler.from_activity_stream('teams') else profiler.get_lookup('memberships')['team_users']
+        if team_id in team_users_index:
+            team_users = team_users_index[team_id] or ['']
+        else:
+            # Team refreshed from the activity stream, or created after the membership index was built
+            team_users = profiler.client.names_list(profiler.client.list_url('teams/' + str(team_id) + '/users'), 'username')
+        if team_users != ['']:
+            profiler.debug('+++ Team ' + str(team_id) + ' has ' + str(len(team_users)) + ' user(s).')
 
         result = str(team_id) + ';' + team_name + ';' + team_org + ';' + str(team_users)
 
         file.write(result + "\n")
 
 
-def extract_users(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
-
+@resource_extractor('users', 'User ID;Username;First Name;Last Name;Teams;Orgs;LDAP DN;Superuser', lookups=['memberships'])
+def extract_users(profiler, file, page_n):
     for user in page_n['results']:
         # Get Hostname
         user_id = user['id']
@@ -165,59 +245,18 @@ def extract_users(file, n):
         else:
             user_is_superuser = 'False'
 
-        # Get user teams
-        user_teams = ['']
-        p = requests.get(
-            controller_host + '/api/v2/users/' + str(user_id) + '/teams?page=1&page_size=' + str(page_size),
-            auth=(controller_user, controller_pass), verify=False)
-        user_teams_page1 = p.json()
-        user_teams_count = user_teams_page1['count']
-        user_teams_pages_count = user_teams_count // page_size + bool(user_teams_count % page_size)
-
-        if user_teams_count > 0:
-            print('+++ User ' + str(user_id) + ' belongs to ' + str(
-                user_teams_count) + ' teams(s). Extracting it from ' + str(
-                user_teams_pages_count) + ' page(s).')
-            for user_team_page_n in range(1, user_teams_pages_count + 1):
-                user_team_list_raw = requests.get(
-                    controller_host + '/api/v2/users/' + str(user_id) + '/teams?page=' + str(
-                        user_team_page_n) + '&page_size=' + str(
-                        page_size), auth=(controller_user, controller_pass), verify=False)
-                user_team_list = user_team_list_raw.json()
-                if user_team_list['results']:
-                    for t in user_team_list['results']:
-                        user_teams.append(t['name'])
-
-        # Removing empty first element
-        if len(user_teams) > 1 and user_teams[0] == '':
-            del user_teams[0]
-
-        # Get user Orgs
-        user_orgs = ['']
-        r = requests.get(
-            controller_host + '/api/v2/users/' + str(user_id) + '/organizations?page=1&page_size=' + str(page_size),
-            auth=(controller_user, controller_pass), verify=False)
-        user_orgs_page1 = r.json()
-        user_orgs_count = user_orgs_page1['count']
-        user_orgs_pages_count = user_orgs_count // page_size + bool(user_orgs_count % page_size)
-
-        if user_orgs_count > 0:
-            print('+++ User ' + str(user_id) + ' belongs to ' + str(
-                user_orgs_count) + ' Organization(s). Extracting it from ' + str(
-                user_orgs_pages_count) + ' page(s).')
-            for user_org_page_n in range(1, user_orgs_pages_count + 1):
-                user_org_list_raw = requests.get(
-                    controller_host + '/api/v2/users/' + str(user_id) + '/organizations?page=' + str(
-                        user_org_page_n) + '&page_size=' + str(
-                        page_size), auth=(controller_user, controller_pass), verify=False)
-                user_org_list = user_org_list_raw.json()
-                if user_org_list['results']:
-                    for t in user_org_list['results']:
-                        user_orgs.append(t['name'])
-
-        # Removing empty first element
-        if len(user_orgs) > 1 and user_orgs[0] == '':
-            del user_orgs[0]
+        # Get user teams and Orgs. Users refreshed from the activity stream are few, their own sub-collections
+        # are listed instead of building the membership index of every team and organization.
+        if profiler.from_activity_stream('users'):
+            user_teams = profiler.client.names_list(profiler.client.list_url('users/' + str(user_id) + '/teams'), 'name')
+            user_orgs = profiler.client.names_list(profiler.client.list_url('users/' + str(user_id) + '/organizations'), 'name')
+        else:
+            user_teams = profiler.get_lookup('memberships')['user_teams'].get(user_id) or ['']
+            user_orgs = profiler.get_lookup('memberships')['user_orgs'].get(user_id) or ['']
+        if user_teams != ['']:
+            profiler.debug('+++ User ' + str(user_id) + ' belongs to ' + str(len(user_teams)) + ' teams(s).')
+        if user_orgs != ['']:
+            profiler.debug('+++ User ' + str(user_id) + ' belongs to ' + str(len(user_orgs)) + ' Organization(s).')
 
         result = str(
             user_id) + ';' + username + ';' + user_first_name + ';' + user_last_name + ';' + str(
@@ -225,14 +264,11 @@ def extract_users(file, n):
         file.write(result + "\n")
 
 
-def extract_inventories(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
-
+@resource_extractor('inventories', 'Inventory ID;Organization;Inventory Name;Created By;Last Modified by;Inventory Kind;Total Hosts;Total Groups;Host Filter;Has Inventory Source;Inventory Sources Details',
+                    lookups=['inventory_sources_by_inventory'])
+def extract_inventories(profiler, file, page_n):
     for inventory in page_n['results']:
-        print("+ Extracting inventory " + str(inventory['id']) + ' details...')
+        profiler.debug("+ Extracting inventory " + str(inventory['id']) + ' details...')
         inventory_id = inventory['id']
         inventory_name = inventory['name']
         inventory_has_sources = inventory['has_inventory_sources']
@@ -271,41 +307,26 @@ def extract_inventories(file, n):
         inventory_sources_list = list()
         # Get inventory sources
         if inventory_has_sources:
-            # Get sources count
-            req = requests.get(
-                controller_host + '/api/v2/' + resource + '/' + str(
-                    inventory_id) + '/inventory_sources' + '?page=1&page_size=' + str(page_size),
-                auth=(controller_user, controller_pass), verify=False)
-            sources_page = req.json()
-            source_count = sources_page['count']
-            sources_pages_count = source_count // page_size + bool(source_count % page_size)
-
-            if source_count > 0:
-                print('++ Inventory ' + str(inventory_id) + ' has ' + str(source_count) + ' source(s) on ' + str(
-                    sources_pages_count) + ' page(s) !')
-                for source_page_n in range(1, sources_pages_count+1):
-                    print('+++ Extracting sources page ' + str(source_page_n) + ' ...')
-                    req = requests.get(
-                        controller_host + '/api/v2/inventories/' + str(inventory_id) + '/inventory_sources' + '?page='+str(source_page_n)+'&page_size=' + str(page_size),
-                        auth=(controller_user, controller_pass), verify=False)
-                    sources_page = req.json()
-                    for s in sources_page['results']:
-                        inventory_source = {'source': s['name'], 'type': s['source']}
-                        if s['summary_fields']['credentials']:
-                            inventory_source['credential'] = list()
-                            for cred in s['summary_fields']['credentials']:
-                                inventory_source_credential_name = cred['name']
-                                # inventory_source_credential_kind = cred['kind']
-                                inventory_source['credential'].append(inventory_source_credential_name)
-                                # inventory_source['credential'].append({inventory_source_credential_name, inventory_source_credential_kind})
-
-                        if s['source_project']:
-                            inventory_source['project_id'] = str(s['source_project'])
-
-                        if s['summary_fields'].get('source_project') is not None :
-                            inventory_source['project_name'] = s['summary_fields']['source_project']['name']
-
-                        inventory_sources_list.append(inventory_source)
+            for s in profiler.get_lookup('inventory_sources_by_inventory').get(inventory_id, list()):
+                inventory_source = {'source': s['name'], 'type': s['source']}
+                if s['summary_fields']['credentials']:
+                    inventory_source['credential'] = list()
+                    for cred in s['summary_fields']['credentials']:
+                        inventory_source_credential_name = cred['name']
+                        # inventory_source_credential_kind = cred['kind']
+                        inventory_source['credential'].append(inventory_source_credential_name)
+                        # inventory_source['credential'].append({inventory_source_credential_name, inventory_source_credential_kind})
+
+                if s['source_project']:
+                    inventory_source['project_id'] = str(s['source_project'])
+
+                if s['summary_fields'].get('source_project') is not None :
+                    inventory_source['project_name'] = s['summary_fields']['source_project']['name']
+
+                inventory_sources_list.append(inventory_source)
+
+            if inventory_sources_list:
+                profiler.debug('++ Inventory ' + str(inventory_id) + ' has ' + str(len(inventory_sources_list)) + ' source(s) !')
 
         result = str(inventory_id) + ';' + inventory_org + ';' + inventory_name + ';' + inventory_creator + ';' + inventory_last_modified_by + ';' + inventory_kind + ';' + str(
             inventory_total_hosts) + ';' + str(inventory_total_groups) + ';' + inventory_host_filter + ';' + str(
@@ -314,125 +335,99 @@ def extract_inventories(file, n):
         file.write(result + "\n")
 
 
-def extract_roles(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
-
-    for role in page_n['results']:
-
-        if role['name'] == 'System Administrator' or role['name'] == 'System Auditor': #and not role['summary_fields']:
-            role_id = role['id']
-            role_name = role['name']
-            resource_type = '*'
-            resource_name = '*'
-            role_teams_list_names = ['']
-            print('+++ Extracting details of role ' + str(role_id))
-
-            # Get System Administrator Or Auditor Role Users
-            r = requests.get(
-                 controller_host + '/api/v2/roles/' + str(role_id) + '/users?page=1&page_size=' + str(page_size),
-                 auth=(controller_user, controller_pass), verify=False)
-            admin_users_page1 = r.json()
-            admin_users_count = admin_users_page1['count']
-            admin_users_pages_count = admin_users_count // page_size + bool(admin_users_count % page_size)
-
-            role_users_list_names = list()
-            if admin_users_count > 0:
-                print('++++ '+ role['name'] + ' role ' + str(role_id) + ' has ' + str(admin_users_count) + ' user(s) in ' + str(admin_users_pages_count) + ' page(s).')
-                for user_n in range(1, admin_users_pages_count + 1):
-                    role_users_list_raw = requests.get(
-                        controller_host + '/api/v2/roles/' + str(role_id) + '/users?page=' + str(
-                            user_n) + '&page_size=' + str(
-                            page_size), auth=(controller_user, controller_pass), verify=False)
-                    role_users_list = role_users_list_raw.json()
-                    if role_users_list['results']:
-                        for u in role_users_list['results']:
-                            role_users_list_names.append(u['username'])
-
-            if role_users_list_names:
-                result = str(role_id) + ';' + resource_type + ';' + resource_name + ';' + role_name + ';' + str(
-                    role_users_list_names) + ';' + str(role_teams_list_names)
-                file.write(result + "\n")
-
-        # Get Role target resource
-        if role['summary_fields']:
-
-            resource_name = role['summary_fields']['resource_name']
-            resource_type = role['summary_fields']['resource_type_display_name']
-            role_name = role['name']
-            role_id = role['id']
-
-            print('+++ Extracting details of role ' + str(role_id))
-            # Get Role Users
-            r = requests.get(
-                controller_host + '/api/v2/roles/' + str(role_id) + '/users?page=1&page_size=' + str(page_size),
-                auth=(controller_user, controller_pass), verify=False)
-            user_page1 = r.json()
-            user_count = user_page1['count']
-            user_pages_count = user_count // page_size + bool(user_count % page_size)
-
-            role_users_list_names = ['']
-            if user_count > 0:
-                print('++++ Role ' + str(role_id) + ' has ' + str(user_count) + ' user(s) in ' + str(
-                    user_pages_count) + ' page(s).')
-                for user_n in range(1, user_pages_count + 1):
-                    role_users_list_raw = requests.get(
-                        controller_host + '/api/v2/roles/' + str(role_id) + '/users?page=' + str(
-                            user_n) + '&page_size=' + str(
-                            page_size), auth=(controller_user, controller_pass), verify=False)
-                    role_users_list = role_users_list_raw.json()
-                    if role_users_list['results']:
-                        for u in role_users_list['results']:
-                            role_users_list_names.append(u['username'])
-
-            # Removing empty first element
-            if len(role_users_list_names) > 1 and role_users_list_names[0] == '':
-                del role_users_list_names[0]
-
-            # Get Role Teams
-
-            r = requests.get(
-                controller_host + '/api/v2/roles/' + str(role_id) + '/teams?page=1&page_size=' + str(page_size),
-                auth=(controller_user, controller_pass), verify=False)
-            teams_page1 = r.json()
-            teams_count = teams_page1['count']
-            teams_pages_count = teams_count // page_size + bool(teams_count % page_size)
-
-            role_teams_list_names = ['']
-
-            if teams_count > 0:
-                print('++++ Role ' + str(role_id) + ' has ' + str(teams_count) + ' team(s) in ' + str(
-                    teams_pages_count) + ' page(s).')
-                for team_n in range(1, teams_pages_count + 1):
-                    role_teams_list_raw = requests.get(
-                        controller_host + '/api/v2/roles/' + str(role_id) + '/teams?page=' + str(
-                            team_n) + '&page_size=' + str(
-                            page_size), auth=(controller_user, controller_pass), verify=False)
-                    role_teams_list = role_teams_list_raw.json()
-                    if role_teams_list['results']:
-                        role_teams_list_names = list()
-                        for u in role_teams_list['results']:
-                            role_teams_list_names.append(u['name'])
-
-            # Removing empty first element
-            # if len(role_teams_list_names) > 1 and role_teams_list_names[0] == '':
-            #    del role_teams_list_names[0]
-
-            # Keep result only if there is a user or a team attributed to the role
-            if role_users_list_names != [''] or role_teams_list_names != ['']:
-                result = str(role_id) + ';' + resource_type + ';' + resource_name + ';' + role_name + ';' + str(
-                    role_users_list_names) + ';' + str(role_teams_list_names)
-                file.write(result + "\n")
-
-
-
-def extract_workflow_job_templates(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+def extract_role(profiler, item):
+    # Render the csv row of one role having members. Users are only listed for roles with direct user members.
+    role, has_users, role_teams_list_names = item
+    role_id = role['id']
+    role_name = role['name']
+    profiler.debug('+++ Extracting details of role ' + str(role_id))
+
+    if role_name == 'System Administrator' or role_name == 'System Auditor':
+        resource_type = '*'
+        resource_name = '*'
+        role_users_list_names = list()
+        if has_users:
+            role_users_list_names = [u['username'] for u in profiler.client.paginate(profiler.client.list_url('roles/' + str(role_id) + '/users'))]
+        if role_users_list_names:
+            profiler.debug('++++ '+ role_name + ' role ' + str(role_id) + ' has ' + str(len(role_users_list_names)) + ' user(s).')
+            return str(role_id) + ';' + resource_type + ';' + resource_name + ';' + role_name + ';' + str(
+                role_users_list_names) + ';' + str(role_teams_list_names or ['']) + "\n"
+        return ''
+
+    # Get Role target resource
+    if not role['summary_fields']:
+        return ''
+    resource_name = role['summary_fields']['resource_name']
+    resource_type = role['summary_fields']['resource_type_display_name']
+
+    # Get Role Users
+    role_users_list_names = ['']
+    if has_users:
+        role_users_list_names = profiler.client.names_list(profiler.client.list_url('roles/' + str(role_id) + '/users'), 'username')
+        profiler.debug('++++ Role ' + str(role_id) + ' has ' + str(len(role_users_list_names)) + ' user(s).')
+
+    # Get Role Teams
+    if role_teams_list_names:
+        profiler.debug('++++ Role ' + str(role_id) + ' has ' + str(len(role_teams_list_names)) + ' team(s).')
+    else:
+        role_teams_list_names = ['']
+
+    # Keep result only if there is a user or a team attributed to the role
+    if role_users_list_names != [''] or role_teams_list_names != ['']:
+        return str(role_id) + ';' + resource_type + ';' + resource_name + ';' + role_name + ';' + str(
+            role_users_list_names) + ';' + str(role_teams_list_names) + "\n"
+    return ''
+
+
+def load_team_roles(profiler, team_id):
+    return team_id, list(profiler.client.paginate(profiler.client.list_url('teams/' + str(team_id) + '/roles')))
+
+
+@resource_extractor('roles', 'Role ID;Object Type;Object Name;Role;Users;Teams', bulk=True, lookups=['teams', 'team_read_roles'])
+def extract_all_roles(profiler, file):
+    # Most roles have no members. Instead of listing the users and teams of every role, only the roles having
+    # members are fetched : roles with users are filtered server side (members__isnull=False) and roles granted
+    # to teams are found by listing the roles of each team and inverting the result.
+    workers = profiler.workers('roles')
+    roles = dict()
+    roles_with_users = set()
+    roles_teams = dict()
+    # (role ID, team ID) pairs already inverted, team names are only unique within an organization
+    granted = set()
+
+    teams = profiler.get_lookup('teams')
+    team_read_roles = profiler.get_lookup('team_read_roles')
+    for team_id, team_roles in ordered_map(lambda team_id: load_team_roles(profiler, team_id), teams, workers, profiler.stopping):
+        # /teams/<id>/roles leaves out the read role of the team itself, whose members include the team
+        if team_id in team_read_roles:
+            team_roles.append(roles.get(team_read_roles[team_id]) or {
+                'id': team_read_roles[team_id], 'name': 'Read',
+                'summary_fields': {'resource_name': teams[team_id], 'resource_type': 'team', 'resource_type_display_name': 'Team'}})
+        for role in team_roles:
+            roles[role['id']] = role
+            if (role['id'], team_id) not in granted:
+                granted.add((role['id'], team_id))
+                roles_teams.setdefault(role['id'], list()).append(teams[team_id])
+
+    for role in profiler.client.paginate(profiler.client.list_url('roles') + '&members__isnull=False'):
+        roles[role['id']] = role
+        roles_with_users.add(role['id'])
+
+    profiler.log('+ ' + str(len(roles)) + ' role(s) have members (' + str(len(roles_with_users)) + ' with users, ' + str(
+        len(roles_teams)) + ' with teams).')
+
+    items = [(roles[role_id], role_id in roles_with_users, roles_teams.get(role_id)) for role_id in sorted(roles)]
+    written = 0
+    profiler.start_progress('roles')
+    for n, rows in enumerate(ordered_map(lambda item: extract_role(profiler, item), items, workers, profiler.stopping), 1):
+        file.write(rows)
+        written += rows.count('\n')
+        profiler.progress('roles', n, len(items), written, 'role')
+
+
+@resource_extractor('workflow_job_templates', 'Workflow ID;Organization;Workflow Name;Inventory;limit;Creator;Last Modified by',
+                    lookups=['organizations', 'inventories'])
+def extract_workflow_job_templates(profiler, file, page_n):
 
     for wkfl in page_n['results']:
         # Get Hostname
@@ -441,13 +436,13 @@ def extract_workflow_job_templates(file, n):
 
         # Get Org
         if wkfl['organization']:
-            wkfl_org = wkfl['organization']
+            wkfl_org = profiler.lookup_name('organizations', wkfl['organization'])
         else:
             wkfl_org = 'Null'
 
         # Get Inventory
         if wkfl['inventory']:
-            wkfl_inventory = wkfl['inventory']
+            wkfl_inventory = profiler.lookup_name('inventories', wkfl['inventory'])
         else:
             wkfl_inventory = 'Null'
         
@@ -474,11 +469,8 @@ def extract_workflow_job_templates(file, n):
         file.write(result + "\n")
 
 
-def extract_job_templates(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('job_templates', 'Job Template ID;Organization;Job Template Name;Project;Credentials;Inventory;limit;Creator;Last Modified by')
+def extract_job_templates(profiler, file, page_n):
     for jt in page_n['results']:
         # Get Hostname
         jt_id = jt['id']
@@ -526,11 +518,8 @@ def extract_job_templates(file, n):
         file.write(result + "\n")
 
 
-def extract_credentials(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('credentials', 'Credential ID;Organization;Credential Name;Kind;Creator;Last Modified by')
+def extract_credentials(profiler, file, page_n):
 
     for cred in page_n['results']:
         # Get Hostname
@@ -570,11 +559,8 @@ def extract_credentials(file, n):
         file.write(result + "\n")
 
 
-def extract_projects(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('projects', 'Project ID;Organization;Project Name;Credential;Creator;Last Modified by')
+def extract_projects(profiler, file, page_n):
 
     for project in page_n['results']:
         # Get Hostname
@@ -609,11 +595,8 @@ def extract_projects(file, n):
         file.write(result + "\n")
 
 
-def extract_host_metrics(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('host_metrics', 'host metric ID;hostname;automated_counter;deleted_counter;deleted;first_automation;last_automation;last_deleted;used_in_inventories;url')
+def extract_host_metrics(profiler, file, page_n):
 
     for host_metric in page_n['results']:
         # Get Hostname
@@ -643,17 +626,13 @@ def extract_host_metrics(file, n):
         file.write(result + "\n")
 
 
-def extract_hosts(file, n):
-    print("++ Page " + str(n) + ' / ' + str(pages_count) + '...')
-
-    req = requests.get(controller_host + '/api/v2/' + resource + '?page=' + str(n) + '&page_size=' + str(page_size),
-                       auth=(controller_user, controller_pass), verify=False)
-    page_n = req.json()
+@resource_extractor('hosts', 'Host ID;Organization;Inventory;Hostname;ansible_host;ansible_ssh_host', lookups=['organizations'])
+def extract_hosts(profiler, file, page_n):
     for host in page_n['results']:
         # Get Hostname
         host_id = host['id']
         hostname = host['name']
-        org_id = str(host['summary_fields']['inventory']['organization_id'])
+        org_id = host['summary_fields']['inventory']['organization_id']
         vars = host['variables']
 
         # Get inventory of host
@@ -679,18 +658,650 @@ def extract_hosts(file, n):
             host_ansible_ssh_host = ''
 
         # Getting Org Name of inventory if "get_hosts_org_name" is set to True
-        if get_hosts_org_name:
-            org_raw = requests.get(controller_host + '/api/v2/organizations/' + org_id, auth=(controller_user, controller_pass), verify=False)
-            org = org_raw.json()
-            org = org['name']
+        if profiler.get_hosts_org_name:
+            org = profiler.lookup_name('organizations', org_id)
         else:
-            org = org_id
+            org = str(org_id)
 
         result = str(host_id) + ';' + org + ';' + inventory + ';' + hostname + ';' + str(
             host_ansible_host) + ';' + str(host_ansible_ssh_host_list)
         file.write(result + "\n")
 
-   
+
+def extract_inventory_hosts(profiler, inventory):
+    # All the hosts of an inventory and their parsed hostvars in a single call.
+    # towervars adds the host ID (remote_tower_id) and all=1 also returns the disabled hosts.
+    profiler.debug('+++ Extracting hosts of inventory ' + str(inventory['id']) + ' (' + str(inventory['total_hosts']) + ' host(s))')
+    script = profiler.client.get_json('/api/v2/inventories/' + str(inventory['id']) + '/script/?hostvars=1&towervars=1&all=1')
+
+    # Getting Org Name of inventory if "get_hosts_org_name" is set to True
+    if profiler.get_hosts_org_name:
+        org = profiler.lookup_name('organizations', inventory['organization'])
+    else:
+        org = str(inventory['organization'])
+
+    hosts = list()
+    for hostname, hostvars in script.get('_meta', dict()).get('hostvars', dict()).items():
+        # Same column format as the 'pages' strategy
+        if hostvars.get('ansible_host'):
+            host_ansible_host = [str(hostvars['ansible_host'])]
+        else:
+            host_ansible_host = ''
+
+        if hostvars.get('ansible_ssh_host'):
+            host_ansible_ssh_host_list = [str(hostvars['ansible_ssh_host'])]
+        else:
+            host_ansible_ssh_host_list = list()
+
+        hosts.append((hostvars['remote_tower_id'], hostname, host_ansible_host, host_ansible_ssh_host_list))
+
+    rows = ''
+    for host_id, hostname, host_ansible_host, host_ansible_ssh_host_list in sorted(hosts, key=lambda h: h[0]):
+        rows += str(host_id) + ';' + org + ';' + inventory['name'] + ';' + hostname + ';' + str(
+            host_ansible_host) + ';' + str(host_ansible_ssh_host_list) + "\n"
+    return rows
+
+
+@resource_extractor('hosts', bulk=True)
+def extract_all_hosts(profiler, file):
+    # Smart inventories are skipped, their hosts belong to other inventories
+    inventories = (inv for inv in profiler.client.paginate(profiler.client.list_url('inventories')) if inv['kind'] != 'smart' and inv['total_hosts'])
+    written = 0
+    for n, rows in enumerate(ordered_map(lambda inventory: extract_inventory_hosts(profiler, inventory), inventories, profiler.hosts_script_workers, profiler.stopping), 1):
+        file.write(rows)
+        written += rows.count('\n')
+        profiler.progress('hosts', n, None, written, 'inventory')
+
+
+def unified_job_row(job, template_field):
+    # Columns shared by jobs and workflow jobs. The names come last, the aggregates are computed from the rows.
+    summary_fields = job['summary_fields']
+    template = summary_fields.get('unified_job_template') or summary_fields.get(template_field)
+    if template:
+        template_id = str(template['id'])
+        template_name = template['name']
+    else:
+        # Template deleted since
+        template_id = str(job.get(template_field) or 'Null')
+        template_name = job['name']
+
+    if summary_fields.get('organization'):
+        job_org = summary_fields['organization']['name']
+    else:
+        job_org = 'Null'
+
+    return str(job['id']) + ';' + template_id + ';' + job['status'] + ';' + str(job['failed']) + ';' + job['launch_type'] + ';' + str(
+        job['created']) + ';' + str(job['started'] or 'Null') + ';' + str(job['finished'] or 'Null') + ';' + str(
+        job['elapsed']) + ';' + template_name + ';' + job_org
+
+
+@resource_extractor('jobs', 'Job ID;Template ID;Status;Failed;Launch Type;Created;Started;Finished;Elapsed;Template;Organization;Inventory;Project',
+                    partitioned=True)
+def extract_jobs(profiler, file, page_n):
+    for job in page_n['results']:
+        if job['summary_fields'].get('inventory'):
+            job_inventory = job['summary_fields']['inventory']['name']
+        else:
+            job_inventory = 'Null'
+
+        if job['summary_fields'].get('project'):
+            job_project = job['summary_fields']['project']['name']
+        else:
+            job_project = 'Null'
+
+        result = unified_job_row(job, 'job_template') + ';' + job_inventory + ';' + job_project
+        file.write(result + "\n")
+
+
+@resource_extractor('workflow_jobs', 'Workflow Job ID;Template ID;Status;Failed;Launch Type;Created;Started;Finished;Elapsed;Template;Organization',
+                    partitioned=True)
+def extract_workflow_jobs(profiler, file, page_n):
+    for job in page_n['results']:
+        file.write(unified_job_row(job, 'workflow_job_template') + "\n")
+
+
+def aggregate_jobs(aggregates, lines):
+    # Per template counters folded from jobs or workflow_jobs rows, see unified_job_row
+    for line in lines:
+        job_id, template_id, status, failed, launch_type, created, started, finished, elapsed, names = line.rstrip("\n").split(';', 9)
+        template = aggregates.setdefault(template_id, {'name': names.split(';')[0], 'jobs': 0, 'successful': 0, 'failed': 0,
+                                                       'elapsed': 0.0, 'max_elapsed': 0.0, 'first': created, 'last': created})
+        template['jobs'] += 1
+        if status == 'successful':
+            template['successful'] += 1
+        elif failed == 'True':
+            template['failed'] += 1
+        template['elapsed'] += float(elapsed)
+        template['max_elapsed'] = max(template['max_elapsed'], float(elapsed))
+        template['first'] = min(template['first'], created)
+        template['last'] = max(template['last'], created)
+
+
+def write_jobs_aggregates(path, aggregates):
+    with open(path + '.tmp', 'w') as f:
+        f.write('Template ID;Template;Jobs;Successful;Failed;Other;Failure Rate;Total Elapsed;Average Elapsed;Max Elapsed;First Created;Last Created' + "\n")
+        for template_id in sorted(aggregates, key=lambda t: (not t.isdigit(), int(t) if t.isdigit() else 0, t)):
+            template = aggregates[template_id]
+            finished = template['successful'] + template['failed']
+            failure_rate = str(round(100.0 * template['failed'] / finished, 1)) + '%' if finished else 'Null'
+            f.write(template_id + ';' + template['name'] + ';' + str(template['jobs']) + ';' + str(template['successful']) + ';' + str(
+                template['failed']) + ';' + str(template['jobs'] - finished) + ';' + failure_rate + ';' + str(round(template['elapsed'], 3)) + ';' + str(
+                round(template['elapsed'] / template['jobs'], 3)) + ';' + str(template['max_elapsed']) + ';' + template['first'] + ';' + template['last'] + "\n")
+    os.replace(path + '.tmp', path)
+
+
+@resource_extractor('roles')
+def extract_role_by_object(profiler, file, page_n):
+    # Refresh of roles touched by the activity stream : users and teams are listed for those roles only
+    for role in page_n['results']:
+        role_teams_list_names = [t['name'] for t in profiler.client.paginate(profiler.client.list_url('roles/' + str(role['id']) + '/teams'))]
+        file.write(extract_role(profiler, (role, True, role_teams_list_names)))
+
+
+class ConcurrencyGovernor(object):
+    # AIMD limit on the number of requests in flight, driven by the controller latency and throttling answers
+    def __init__(self, minimum, maximum, target, log):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.log = log
+        self.limit = minimum
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= self.limit:
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    def release(self, latency, status, retry_after=0):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            throttled = status in (429, 503)
+            if throttled and retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+                self.log('+ Governor : controller answered ' + str(status) + ', pausing requests for ' + str(retry_after) + 's')
+
+            if throttled or latency > self.target:
+                # Requests already in flight answer slowly too, decrease at most once per round-trip
+                if now - self.last_decrease > latency and self.limit > self.minimum:
+                    old_limit = self.limit
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.log('+ Governor : requests in flight ' + str(old_limit) + ' -> ' + str(self.limit) + ' (' + (
+                        'HTTP ' + str(status) if throttled else 'latency ' + str(round(latency, 2)) + 's') + ')')
+                    self.last_decrease = now
+                self.successes = 0
+            elif status is not None and status < 500:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+                    self.log('+ Governor : requests in flight ' + str(self.limit - 1) + ' -> ' + str(self.limit) + ' (latency ' + str(round(latency, 2)) + 's)')
+            self.condition.notify_all()
+
+
+# Resource (or lookup table) on whose behalf the current thread works, used to attribute the API requests
+current_resource = contextvars.ContextVar('current_resource', default='pre_flight')
+
+
+class Metrics(object):
+    # Request counters per resource and endpoint family (count, bytes, latencies, retries, JSON parsing time),
+    # plus the time spent rendering and writing rows per resource. Filled by the API client and the extraction loop.
+
+    # Latencies kept per endpoint family for the percentiles (reservoir sample)
+    latency_samples = 10000
+
+    # An endpoint family requested for at least this many different parent objects is reported as N+1
+    n_plus_one_threshold = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = dict()
+        self.timings = dict()
+
+    def record_request(self, url, latency, size, failed, retry, parse_time):
+        family = endpoint_family(url)
+        # Parent object of a sub-collection, e.g. 123 in /api/v2/roles/123/users/
+        parent = re.search(r'/(\d+)(?=/|$)', urlsplit(url).path)
+        with self.lock:
+            endpoint = self.endpoints.setdefault((current_resource.get(), family), {
+                'requests': 0, 'bytes': 0, 'failed': 0, 'retries': 0, 'parse_time': 0.0, 'latency_total': 0.0,
+                'latencies': list(), 'parents': set()})
+            endpoint['requests'] += 1
+            endpoint['bytes'] += size
+            endpoint['failed'] += failed
+            endpoint['retries'] += retry
+            endpoint['parse_time'] += parse_time
+            endpoint['latency_total'] += latency
+            if len(endpoint['latencies']) < self.latency_samples:
+                endpoint['latencies'].append(latency)
+            else:
+                slot = random.randrange(endpoint['requests'])
+                if slot < self.latency_samples:
+                    endpoint['latencies'][slot] = latency
+            if parent:
+                endpoint['parents'].add(parent.group(1))
+
+    def add_time(self, kind, seconds):
+        with self.lock:
+            timings = self.timings.setdefault(current_resource.get(), {'render_time': 0.0, 'write_time': 0.0})
+            timings[kind] += seconds
+
+    def report(self, rows, duration):
+        # performance.json content, resources and endpoint families sorted by time spent
+        resources = dict()
+        with self.lock:
+            for (resource, family), endpoint in self.endpoints.items():
+                latencies = sorted(endpoint['latencies'])
+                percentile = lambda p: round(latencies[int(p * (len(latencies) - 1))], 4)
+                entry = {'requests': endpoint['requests'], 'bytes': endpoint['bytes'], 'failed': endpoint['failed'],
+                         'retries': endpoint['retries'], 'parse_time': round(endpoint['parse_time'], 3),
+                         'latency_total': round(endpoint['latency_total'], 3),
+                         'latency': {'mean': round(endpoint['latency_total'] / endpoint['requests'], 4), 'p50': percentile(0.5),
+                                     'p90': percentile(0.9), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': latencies[-1]}}
+                if '{id}' in family:
+                    entry['parents'] = len(endpoint['parents'])
+                    entry['requests_per_parent'] = round(endpoint['requests'] / max(1, len(endpoint['parents'])), 2)
+                    entry['n_plus_one'] = len(endpoint['parents']) >= self.n_plus_one_threshold
+                resource_entry = resources.setdefault(resource, {'rows': rows.get(resource), 'requests': 0, 'bytes': 0, 'retries': 0,
+                                                                 'latency_total': 0.0, 'parse_time': 0.0, 'endpoints': dict()})
+                resource_entry['endpoints'][family] = entry
+                for key in ('requests', 'bytes', 'retries', 'latency_total', 'parse_time'):
+                    resource_entry[key] += entry[key]
+            for resource, timings in self.timings.items():
+                resource_entry = resources.setdefault(resource, {'rows': rows.get(resource), 'requests': 0, 'bytes': 0, 'retries': 0,
+                                                                 'latency_total': 0.0, 'parse_time': 0.0, 'endpoints': dict()})
+                resource_entry.update({kind: round(seconds, 3) for kind, seconds in timings.items()})
+
+        for resource_entry in resources.values():
+            resource_entry['latency_total'] = round(resource_entry['latency_total'], 3)
+            resource_entry['parse_time'] = round(resource_entry['parse_time'], 3)
+            resource_entry['endpoints'] = dict(sorted(resource_entry['endpoints'].items(), key=lambda e: -e[1]['latency_total']))
+        resources = dict(sorted(resources.items(), key=lambda r: -r[1]['latency_total']))
+        return {'duration': round(duration, 1), 'requests': sum(r['requests'] for r in resources.values()),
+                'bytes': sum(r['bytes'] for r in resources.values()), 'resources': resources}
+
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return 1
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(parsedate_to_datetime(value).tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return 1
+
+
+def endpoint_family(url):
+    # '/api/v2/roles/123/users/?page=2' -> '/api/v2/roles/{id}/users/'
+    return re.sub(r'/\d+(?=/|$)', '/{id}', urlsplit(url).path.rstrip('/') + '/')
+
+
+def capture_key(url):
+    # Responses are keyed by path and query string, so that the archive does not depend on the host or port used
+    parts = urlsplit(url)
+    key = parts.path + ('?' + parts.query if parts.query else '')
+    return key, hashlib.sha1(key.encode()).hexdigest() + '.json'
+
+
+class ApiClient(object):
+    # HTTP side of a profiler : keep-alive session, authentication, concurrency governor, retries,
+    # circuit breakers, record / replay of the responses and pagination of the listings.
+    def __init__(self, config, log, metrics=None, stopping=None):
+        self.controller_fqdn = config['controller_fqdn']
+        self.controller_host = 'https://' + config['controller_fqdn'] + ':' + str(config['controller_port'])
+        self.controller_user = config['controller_user']
+        self.controller_pass = config['controller_pass']
+        self.controller_token = config['controller_token']
+        self.page_size = config['page_size']
+        self.pagination_mode = config['pagination_mode']
+        self.timeout = (config['connect_timeout'], config['read_timeout'])
+        self.max_retries = config['max_retries']
+        self.circuit_breaker_threshold = config['circuit_breaker_threshold']
+        self.circuit_breaker_cooldown = config['circuit_breaker_cooldown']
+        self.capture_mode = config['capture_mode']
+        self.capture_file = config['capture_file']
+        self.log = log
+        self.metrics = metrics or Metrics()
+        # Set when the run is stopping, the requests not sent yet raise ExtractionStopped
+        self.stopping = stopping or threading.Event()
+
+        self.session = requests.Session()
+        if self.controller_token:
+            self.session.headers['Authorization'] = 'Bearer ' + self.controller_token
+        else:
+            self.session.auth = (self.controller_user, self.controller_pass)
+        self.session.headers.update({'Accept': 'application/json', 'User-Agent': 'AAProfiler/0.5'})
+        adapter = HTTPAdapter(pool_connections=config['http_pool_size'], pool_maxsize=config['http_pool_size'])
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.governor = ConcurrencyGovernor(config['min_requests_in_flight'], config['max_requests_in_flight'],
+                                            config['target_latency'], log)
+        self.breakers = dict()
+        self.breakers_lock = threading.Lock()
+        self.capture = None
+        self.captured = set()
+        self.capture_lock = threading.Lock()
+        self.created_token_id = None
+
+    def wait_for_breaker(self, family):
+        # An open circuit pauses the requests of its endpoint family until the cooldown is over
+        with self.breakers_lock:
+            breaker = self.breakers.setdefault(family, {'failures': 0, 'open_until': 0})
+            pause = breaker['open_until'] - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def record_breaker(self, family, failed):
+        with self.breakers_lock:
+            breaker = self.breakers[family]
+            if not failed:
+                breaker['failures'] = 0
+                return
+            breaker['failures'] += 1
+            if breaker['failures'] >= self.circuit_breaker_threshold and breaker['open_until'] < time.monotonic():
+                breaker['open_until'] = time.monotonic() + self.circuit_breaker_cooldown
+                self.log('+ Circuit breaker : ' + family + ' failed ' + str(breaker['failures']) + ' times in a row, pausing it for ' + str(self.circuit_breaker_cooldown) + 's', logging.WARNING)
+
+    def request(self, url, decode_json):
+        # GET with timeouts, retries (jittered exponential backoff) and a circuit breaker per endpoint family.
+        # The JSON body is decoded here when asked, so that a truncated answer is retried too.
+        # Relative API paths are resolved against the controller
+        if url.startswith('/'):
+            url = self.controller_host + url
+        if self.capture_mode == 'replay':
+            start = time.monotonic()
+            response = self.replay_response(url)
+            data = response.json() if decode_json else None
+            self.metrics.record_request(url, time.monotonic() - start, len(response.content), False, False, 0)
+            return response, data
+
+        family = endpoint_family(url)
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_breaker(family)
+            if self.stopping.is_set():
+                raise ExtractionStopped()
+            self.governor.acquire()
+            start = time.monotonic()
+            response = None
+            data = None
+            latency = None
+            parse_time = 0
+            try:
+                # verify is passed per request, a session level value is overridden by REQUESTS_CA_BUNDLE
+                response = self.session.get(url, verify=False, timeout=self.timeout)
+                latency = time.monotonic() - start
+                if decode_json and response.status_code < 300:
+                    data = response.json()
+                    parse_time = time.monotonic() - start - latency
+                error = None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+
+            if latency is None:
+                latency = time.monotonic() - start
+            status = response.status_code if response is not None else None
+            throttled = status in (429, 503)
+            # Throttled requests wait for Retry-After in the governor
+            self.governor.release(latency, status, retry_after_seconds(response) if throttled else 0)
+            failed = error is not None or status >= 500 or status == 429
+            self.metrics.record_request(url, latency, len(response.content) if response is not None else 0, failed, attempt > 0, parse_time)
+
+            if not failed:
+                self.record_breaker(family, False)
+                break
+            if status != 429:
+                self.record_breaker(family, True)
+
+            reason = str(error) if error is not None else 'HTTP ' + str(status)
+            if attempt == self.max_retries:
+                raise requests.exceptions.RetryError('GET ' + url + ' failed after ' + str(self.max_retries + 1) + ' attempt(s) : ' + reason)
+            if not throttled:
+                delay = random.uniform(0, min(60, 2 ** attempt))
+                self.log('+ Retrying GET ' + url + ' in ' + str(round(delay, 1)) + 's (' + reason + ')')
+                time.sleep(delay)
+
+        if self.capture_mode == 'record':
+            self.record_response(url, response)
+        if decode_json and data is None:
+            data = response.json()
+        return response, data
+
+    def get(self, url):
+        return self.request(url, False)[0]
+
+    def get_json(self, url):
+        return self.request(url, True)[1]
+
+    def open_capture(self):
+        path = self.capture_file
+        if self.capture_mode == 'record':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.capture = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+            self.log('+ Recording API responses in ' + path)
+        else:
+            if not os.path.exists(path):
+                raise ProfilerError(f"Capture archive {path} does not exist ! Run the script with '--record' first.", 30)
+            self.capture = zipfile.ZipFile(path, 'r')
+            self.log('+ Replaying API responses from ' + path)
+
+    def record_response(self, url, response):
+        key, name = capture_key(url)
+        entry = {'url': key, 'status': response.status_code, 'date': response.headers.get('Date'), 'body': response.text}
+        with self.capture_lock:
+            # The same URL can be requested twice (ping...), the first response is kept
+            if name not in self.captured:
+                self.captured.add(name)
+                self.capture.writestr(name, json.dumps(entry))
+
+    def replay_response(self, url):
+        key, name = capture_key(url)
+        try:
+            with self.capture_lock:
+                entry = json.loads(self.capture.read(name))
+        except KeyError:
+            raise LookupError('No response recorded for ' + key + '. The capture was made with different settings.')
+        response = requests.Response()
+        response.url = url
+        response.status_code = entry['status']
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        if entry['date']:
+            response.headers['Date'] = entry['date']
+        return response
+
+    def create_token(self):
+        req = self.session.post(self.controller_host + '/api/v2/tokens/',
+                                json={'description': 'AAProfiler extraction', 'application': None, 'scope': 'read'},
+                                verify=False, timeout=self.timeout)
+        if req.status_code > 299:
+            self.log(f"WARNING : Could not create an OAuth2 token (HTTP {req.status_code}). Falling back to Basic authentication.", logging.WARNING)
+            return
+
+        token = req.json()
+        self.created_token_id = token['id']
+        self.session.auth = None
+        self.session.headers['Authorization'] = 'Bearer ' + token['token']
+        self.log('+ OAuth2 token ' + str(self.created_token_id) + ' created. It will be used for the rest of the extraction.')
+
+    def revoke_token(self):
+        # A 'read' scoped token cannot delete itself, so the revocation uses the user credentials
+        req = self.session.delete(self.controller_host + '/api/v2/tokens/' + str(self.created_token_id) + '/',
+                                  auth=(self.controller_user, self.controller_pass), verify=False, timeout=self.timeout)
+        if req.status_code > 299:
+            self.log(f"WARNING : Could not revoke OAuth2 token {self.created_token_id} (HTTP {req.status_code}). Please delete it manually.", logging.WARNING)
+        else:
+            self.log('+ OAuth2 token ' + str(self.created_token_id) + ' revoked.')
+        self.created_token_id = None
+
+    def close(self):
+        # Revoke the token created for the run and flush the capture archive
+        if self.created_token_id is not None:
+            self.revoke_token()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        self.session.close()
+
+    def list_url(self, path):
+        if self.pagination_mode == 'keyset':
+            return '/api/v2/' + path + '/?page_size=' + str(self.page_size) + '&order_by=id'
+        return '/api/v2/' + path + '/?page_size=' + str(self.page_size)
+
+    def iter_pages(self, url, first_page=None):
+        # Yields every page of a listing by following the 'next' links (or the ID windows in keyset mode).
+        # The first page can be passed when already fetched
+        if first_page is None:
+            first_page = self.get_json(url)
+        page = first_page
+        while True:
+            yield page
+            if not page.get('next') or not page['results']:
+                return
+            if self.pagination_mode == 'keyset':
+                # The listing is ordered by ID (see list_url), the next window starts after the last ID seen
+                page = self.get_json(self.after_id(url, page['results'][-1]['id']))
+            else:
+                page = self.get_json(page['next'])
+
+    def after_id(self, url, last_id):
+        # Window of a listing starting after last_id. A lower bound already in the listing (ID range of a shard)
+        # is replaced, as last_id is always above it.
+        return re.sub(r'&id__gt=\d+', '', url) + '&id__gt=' + str(last_id)
+
+    def paginate(self, url):
+        # Yields every object of a listing, pages are fetched lazily
+        for page in self.iter_pages(url):
+            yield from page['results']
+
+    def names_list(self, url, key):
+        # Returns the 'key' field of every object of a listing, or [''] when the listing is empty
+        names = [obj[key] for obj in self.paginate(url)]
+        return names or ['']
+
+
+def load_names(profiler, path):
+    return {obj['id']: obj['name'] for obj in profiler.client.paginate(profiler.client.list_url(path))}
+
+
+def group_inventory_sources(profiler):
+    sources = dict()
+    for source in profiler.get_lookup('inventory_sources'):
+        sources.setdefault(source['inventory'], list()).append(source)
+    return sources
+
+
+def load_team_read_roles(profiler):
+    # Read role ID of every team, from the roles of the team object
+    return {team['id']: team['summary_fields']['object_roles']['read_role']['id'] for team in profiler.client.paginate(profiler.client.list_url('teams'))
+            if 'read_role' in team['summary_fields'].get('object_roles', dict())}
+
+
+def load_team_members(profiler, team_id):
+    return team_id, list(profiler.client.paginate(profiler.client.list_url('teams/' + str(team_id) + '/users')))
+
+
+def load_memberships(profiler):
+    # Membership index built from the teams and organizations members, instead of listing the teams and
+    # organizations of every single user. Only names are kept, keyed by object ID.
+    team_users = dict()
+    user_teams = dict()
+    user_orgs = dict()
+
+    teams = profiler.get_lookup('teams')
+    for team_id, members in ordered_map(lambda team_id: load_team_members(profiler, team_id), teams, profiler.workers('teams'), profiler.stopping):
+        team_users[team_id] = [u['username'] for u in members]
+        for u in members:
+            user_teams.setdefault(u['id'], list()).append(teams[team_id])
+
+    # Direct members only, like /users/<id>/organizations
+    for org_id, org_name in profiler.get_lookup('organizations').items():
+        for u in profiler.client.paginate(profiler.client.list_url('organizations/' + str(org_id) + '/users')):
+            user_orgs.setdefault(u['id'], list()).append(org_name)
+
+    profiler.log('+ Membership index built : ' + str(len(team_users)) + ' team(s), ' + str(len(user_orgs)) + ' user(s) in organizations.')
+    return {'team_users': team_users, 'user_teams': user_teams, 'user_orgs': user_orgs}
+
+
+# Shared data sets, loaded once per profiler on first use and reused by every extractor
+lookup_loaders = {
+    'organizations': lambda profiler: load_names(profiler, 'organizations'),
+    'inventories': lambda profiler: load_names(profiler, 'inventories'),
+    'teams': lambda profiler: load_names(profiler, 'teams'),
+    'inventory_sources': lambda profiler: list(profiler.client.paginate(profiler.client.list_url('inventory_sources'))),
+    'inventory_sources_by_inventory': group_inventory_sources,
+    'team_read_roles': load_team_read_roles,
+    'memberships': load_memberships,
+}
+
+# Lookup tables built from other lookup tables
+lookup_dependencies = {
+    'inventory_sources_by_inventory': ['inventory_sources'],
+    'memberships': ['teams', 'organizations'],
+}
+
+
+def ordered_map(func, items, workers, stop=None):
+    # Runs func on each item with a bounded pool of threads and yields the results in the same order as items.
+    # Once the stop event is set, no new item is started and ExtractionStopped is raised.
+    def check_stop():
+        if stop is not None and stop.is_set():
+            raise ExtractionStopped()
+
+    if workers <= 1:
+        for item in items:
+            check_stop()
+            yield func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = deque()
+        for item in items:
+            check_stop()
+            # The workers inherit the context of the caller (resource the requests are attributed to)
+            pending.append(executor.submit(contextvars.copy_context().run, func, item))
+            # Do not run too far ahead of the writer, results are kept in memory until written
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            check_stop()
+            yield pending.popleft().result()
+    finally:
+        # Items not started yet are dropped when the caller stops early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def count_rows(path):
+    # Number of rows of a csv file, header excluded
+    with open(path) as csv_file:
+        return sum(1 for line in csv_file) - 1
+
+
+def read_rows(path):
+    # Previous csv rows keyed by their ID (first column)
+    rows = dict()
+    with open(path) as csv_file:
+        next(csv_file)
+        for line in csv_file:
+            rows[line.split(';', 1)[0]] = line
+    return rows
+
+
 def check_socket(host, port):
     with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
         try:
@@ -702,178 +1313,1262 @@ def check_socket(host, port):
             return False
 
 
-def pre_flight_check():
-    try: controller_fqdn
-    except NameError:
-        print('ERROR : Controller address or hostname or FQDN (controller_fqdn) is not defined ! Exiting.')
-        exit(1)
+def validate_config(config):
+    unknown = [name for name in config if name not in DEFAULT_CONFIG]
+    if unknown:
+        raise ProfilerError(f"Unknown option(s) {', '.join(map(str, unknown))} ! Should be one of : {list(DEFAULT_CONFIG)}", 47)
 
-    try: controller_user
-    except NameError:
-        print(f'ERROR : User (controller_user) is not defined ! Exiting.')
-        exit(2)
-    
-    try: controller_pass
-    except NameError:
-        print(f'ERROR : Password (controller_pass) is not defined ! Exiting.')
-        exit(3)
+    if not config.get('controller_fqdn'):
+        raise ProfilerError('Controller address or hostname or FQDN (controller_fqdn) is not defined ! Exiting.', 1)
 
-    try: controller_port
-    except NameError:
-        print(f'ERROR : Port (controller_port) is not defined ! Exiting.')
-        exit(4)
+    if not config.get('controller_token'):
+        if not config.get('controller_user'):
+            raise ProfilerError('User (controller_user) is not defined ! Exiting.', 2)
 
-    if not isinstance(controller_port, int):
-        print(f"ERROR : Port (controller_port) should be an integer and not {type(page_size)} !")
-        exit(5)
+        if not config.get('controller_pass'):
+            raise ProfilerError('Password (controller_pass) is not defined ! Exiting.', 3)
 
-    try: page_size
-    except NameError:
-        print(f"ERROR : Page size (page_size) is not defined ! Please define it than rerun.")
-        exit(6)
+    if config.get('controller_port') is None:
+        raise ProfilerError('Port (controller_port) is not defined ! Exiting.', 4)
 
-    if not isinstance(page_size, int):
-        print(f"ERROR : Page size (page_size) should be an integer and not {type(page_size)} !")
-        exit(7)
+    if not isinstance(config['controller_port'], int):
+        raise ProfilerError(f"Port (controller_port) should be an integer and not {type(config['controller_port'])} !", 5)
 
-    if 0 > page_size or page_size > 200:
-        print(f"ERROR : Page size (page_size) should be between 1 and 200 (and not {page_size}) !")
-        exit(8)
+    if config.get('page_size') is None:
+        raise ProfilerError("Page size (page_size) is not defined ! Please define it than rerun.", 6)
 
-    try: get_hosts_org_name
-    except NameError:
-        print(f"ERROR : get_hosts_org_name is not defined ! Please define it than rerun.")
-        exit(9)
+    if not isinstance(config['page_size'], int):
+        raise ProfilerError(f"Page size (page_size) should be an integer and not {type(config['page_size'])} !", 7)
 
+    if 0 > config['page_size'] or config['page_size'] > 200:
+        raise ProfilerError(f"Page size (page_size) should be between 1 and 200 (and not {config['page_size']}) !", 8)
 
-    if not isinstance(get_hosts_org_name, bool):
-        print(f"ERROR : Page size (page_size) should be a boolean and not {type(get_hosts_org_name)} !")
-        exit(10)
+    if config.get('get_hosts_org_name') is None:
+        raise ProfilerError("get_hosts_org_name is not defined ! Please define it than rerun.", 9)
 
-    if not resources_to_extract:
-        print(f"ERROR : Resources to be extract (resources_to_extract) is not defined !")
-        exit(11)
+    if not isinstance(config['get_hosts_org_name'], bool):
+        raise ProfilerError(f"get_hosts_org_name should be a boolean and not {type(config['get_hosts_org_name'])} !", 10)
 
-    if not isinstance(resources_to_extract, list):
-        print(f"ERROR : Resources to be extract (resources_to_extract) should be a list and not {type(get_hosts_org_name)} !")
-        exit(12)
+    if not config.get('resources_to_extract'):
+        raise ProfilerError("Resources to be extract (resources_to_extract) is not defined !", 11)
 
-    for res in resources_to_extract:
+    if not isinstance(config['resources_to_extract'], list):
+        raise ProfilerError(f"Resources to be extract (resources_to_extract) should be a list and not {type(config['resources_to_extract'])} !", 12)
+
+    for res in config['resources_to_extract']:
         if res not in all_possible_resources:
-            print(f"ERROR : '{res}' is not a known resource. Should be one of : {all_possible_resources} !")
-            exit(13)
+            raise ProfilerError(f"'{res}' is not a known resource. Should be one of : {all_possible_resources} !", 13)
 
-    if not check_socket(controller_fqdn, controller_port):
-        print(f'ERROR : Controller {controller_fqdn} unreachable on port {controller_port} ! Exiting.')
-        exit(14)
+    if config.get('http_pool_size') is None:
+        raise ProfilerError("HTTP connection pool size (http_pool_size) is not defined ! Please define it than rerun.", 18)
 
-    try:
-        req1 = requests.get(f"https://{controller_fqdn}/api/v2/ping", verify=False)
+    if not isinstance(config['http_pool_size'], int) or config['http_pool_size'] < 1:
+        raise ProfilerError(f"HTTP connection pool size (http_pool_size) should be a positive integer and not {config['http_pool_size']} !", 19)
+
+    if not isinstance(config['use_token_auth'], bool):
+        raise ProfilerError(f"use_token_auth should be a boolean and not {type(config['use_token_auth'])} !", 20)
+
+    if not isinstance(config['default_page_workers'], int) or config['default_page_workers'] < 1:
+        raise ProfilerError(f"default_page_workers should be a positive integer and not {config['default_page_workers']} !", 21)
+
+    if not isinstance(config['page_workers'], dict):
+        raise ProfilerError(f"page_workers should be a dict and not {type(config['page_workers'])} !", 22)
+
+    for res, workers in config['page_workers'].items():
+        if res not in all_possible_resources or not isinstance(workers, int) or workers < 1:
+            raise ProfilerError(f"page_workers['{res}'] should be a known resource with a positive integer (and not {workers}) !", 23)
+
+    if config['hosts_strategy'] not in ('pages', 'script'):
+        raise ProfilerError(f"hosts_strategy should be 'pages' or 'script' and not '{config['hosts_strategy']}' !", 24)
+
+    if not isinstance(config['hosts_script_workers'], int) or config['hosts_script_workers'] < 1:
+        raise ProfilerError(f"hosts_script_workers should be a positive integer and not {config['hosts_script_workers']} !", 25)
+
+    if config['pagination_mode'] not in ('page', 'keyset'):
+        raise ProfilerError(f"pagination_mode should be 'page' or 'keyset' and not '{config['pagination_mode']}' !", 26)
+
+    if not isinstance(config['incremental'], bool):
+        raise ProfilerError(f"incremental should be a boolean and not {type(config['incremental'])} !", 27)
+
+    if not isinstance(config['change_capture'], bool):
+        raise ProfilerError(f"change_capture should be a boolean and not {type(config['change_capture'])} !", 28)
+
+    if not isinstance(config['resume'], bool):
+        raise ProfilerError(f"resume should be a boolean and not {type(config['resume'])} !", 29)
+
+    if config['capture_mode'] not in (None, 'record', 'replay'):
+        raise ProfilerError(f"capture_mode should be None, 'record' or 'replay' and not '{config['capture_mode']}' !", 31)
+
+    minimum = config['min_requests_in_flight']
+    maximum = config['max_requests_in_flight']
+    if not isinstance(minimum, int) or not isinstance(maximum, int) or not 1 <= minimum <= maximum:
+        raise ProfilerError("min_requests_in_flight and max_requests_in_flight should be integers with 1 <= min <= max !", 32)
+
+    if not isinstance(config['target_latency'], (int, float)) or config['target_latency'] <= 0:
+        raise ProfilerError(f"target_latency should be a positive number of seconds and not {config['target_latency']} !", 33)
+
+    for name in ('connect_timeout', 'read_timeout', 'circuit_breaker_cooldown'):
+        if not isinstance(config[name], (int, float)) or config[name] <= 0:
+            raise ProfilerError(f"{name} should be a positive number of seconds and not {config[name]} !", 34)
+
+    if not isinstance(config['max_retries'], int) or config['max_retries'] < 0 or not isinstance(config['circuit_breaker_threshold'], int) or config['circuit_breaker_threshold'] < 1:
+        raise ProfilerError("max_retries should be a positive integer (or 0) and circuit_breaker_threshold a positive integer !", 35)
+
+    if not isinstance(config['resource_workers'], int) or config['resource_workers'] < 1:
+        raise ProfilerError(f"resource_workers should be a positive integer and not {config['resource_workers']} !", 37)
+
+    if not isinstance(config['resource_filters'], dict) or any(res not in all_possible_resources or not isinstance(query, str) for res, query in config['resource_filters'].items()):
+        raise ProfilerError(f"resource_filters should be a dict of known resources and query strings and not {config['resource_filters']} !", 41)
+
+    if not isinstance(config['jobs_partition_size'], int) or config['jobs_partition_size'] < 1 or not isinstance(config['jobs_aggregates'], bool):
+        raise ProfilerError(f"jobs_partition_size should be a positive integer and jobs_aggregates a boolean !", 44)
+
+    if config['log_level'] not in ('debug', 'info', 'warning') or not isinstance(config['progress_interval'], (int, float)) or config['progress_interval'] < 0:
+        raise ProfilerError(f"log_level should be 'debug', 'info' or 'warning' and progress_interval a positive number of seconds !", 46)
+
+    if not isinstance(config['estimate_samples'], int) or config['estimate_samples'] < 1:
+        raise ProfilerError(f"estimate_samples should be a positive integer and not {config['estimate_samples']} !", 45)
+
+    if config['resource_filters'] and (config['incremental'] or config['change_capture']):
+        raise ProfilerError("resource_filters cannot be combined with incremental or change_capture !", 48)
+
+
+class Profiler(object):
+    # One extraction of one controller. Everything a run needs (options, HTTP client, lookup tables, state,
+    # checkpoint journal and log file) lives on the instance, so several profilers can run in the same process.
+
+    # Resources having a 'modified' timestamp and an ID column, that can be extracted incrementally
+    incremental_resources = ['credentials', 'projects', 'hosts', 'job_templates', 'workflow_job_templates']
+
+    # Resources started first when several resources are extracted at the same time, they usually take the longest
+    long_resources = ['jobs', 'hosts', 'roles', 'host_metrics', 'workflow_jobs', 'users', 'teams', 'inventories']
+
+    # Resources with per template aggregates (jobs_aggregates)
+    aggregated_resources = ['jobs', 'workflow_jobs']
+
+    # Activity stream object types kept up to date with change_capture
+    activity_stream_types = {'project': 'projects', 'credential': 'credentials', 'job_template': 'job_templates',
+                             'team': 'teams', 'user': 'users', 'role': 'roles'}
+
+    # Activity stream object types whose deletion also deletes their roles, without any role event
+    role_owner_types = ['organization', 'project', 'credential', 'job_template', 'workflow_job_template', 'inventory', 'team']
+
+    # Sub-collections listed for every parent object by a full extraction, per resource or lookup table :
+    # (parent resource, sub-collection, filter of the parents, resource whose page workers list them)
+    fan_out = {
+        'memberships': [('teams', 'users', '', 'teams'), ('organizations', 'users', '', None)],
+        'roles': [('teams', 'roles', '', 'roles'), ('roles', 'users', '&members__isnull=False', 'roles')],
+    }
+
+    def __init__(self, config=None, quiet=False, **options):
+        # quiet : log to extraction.log only, e.g. when several controllers are profiled at the same time
+        self.quiet = quiet
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config or dict())
+        self.config.update(options)
+        validate_config(self.config)
+        if not self.config['results_dir']:
+            self.config['results_dir'] = 'results_' + self.config['controller_fqdn'].replace(".", "_").lower()
+        if not self.config['capture_file']:
+            self.config['capture_file'] = self.config['results_dir'] + '/api_capture.zip'
+        # Options are also readable as attributes, e.g. profiler.page_size
+        for name, value in self.config.items():
+            setattr(self, name, value)
+
+        # The extraction threads only queue their log records, a background thread writes them (see open_log)
+        self.logger = logging.Logger('aaprofiler', self.log_level.upper())
+        self.log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(self.log_queue))
+        self.log_listener = None
+        self.log_file = None
+        self.log_lock = threading.Lock()
+        self.progress_lines = dict()
+        self.metrics = Metrics()
+        # Set on the first error or interruption, the running resources stop at their next page
+        self.stopping = threading.Event()
+        self.client = ApiClient(self.config, self.log, self.metrics, self.stopping)
+        self.controller_host = self.client.controller_host
+        self.lookups = dict()
+        self.lookup_locks = dict()
+        self.lookup_locks_guard = threading.Lock()
+        self.state = dict()
+        self.changes = dict()
+        self.stream_cursors = dict()
+        self.role_owners_deleted = False
+        self.checkpoints = dict()
+        self.journal = None
+        self.journal_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.durations = dict()
+        self.samples = dict()
+
+    def log(self, message='', level=logging.INFO):
+        # Terminal and extraction.log of this profiler (once the results directory exists)
+        if self.log_listener is None:
+            with self.log_lock:
+                if self.log_listener is None:
+                    self.open_log()
+        self.logger.log(level, message)
+
+    def debug(self, message):
+        # Detail of every page and object, only logged with log_level 'debug'
+        self.log(message, logging.DEBUG)
+
+    def open_log(self, path=None):
+        # (Re)starts the background thread writing the queued log records to the terminal and to the log file
+        self.close_log()
+        handlers = list()
+        if not self.quiet:
+            handlers.append(logging.StreamHandler(sys.stdout))
+        if path:
+            self.log_file = logging.FileHandler(path)
+            handlers.append(self.log_file)
+        self.log_listener = logging.handlers.QueueListener(self.log_queue, *handlers)
+        self.log_listener.start()
+
+    def close_log(self):
+        # Writes the records still queued and stops the background thread
+        if self.log_listener:
+            self.log_listener.stop()
+            self.log_listener = None
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+    def start_progress(self, resource, done=0):
+        # Starts the clock of the rows/s and ETA of a resource, 'done' units were extracted by an interrupted run
+        self.progress_lines[resource] = (time.monotonic(), time.monotonic(), done)
+
+    def progress(self, resource, done, total, rows, unit='page'):
+        # Progress line of a resource (rows/s and ETA), at most every progress_interval seconds.
+        # Called by the thread writing the csv file of the resource, once start_progress started the clock.
+        started, logged, first = self.progress_lines[resource]
+        now = time.monotonic()
+        if now - logged < self.progress_interval:
+            return
+        self.progress_lines[resource] = (started, now, first)
+        elapsed = now - started
+        line = '++ ' + resource + ' : ' + unit + ' ' + str(done) + (' / ' + str(total) if total else '') + ', ' + str(rows) + ' row(s), ' + str(
+            round(rows / elapsed)) + ' rows/s'
+        if total and done > first:
+            line += ', ETA ' + str(timedelta(seconds=round(elapsed / (done - first) * (total - done))))
+        self.log(line)
+
+    def workers(self, resource):
+        return self.page_workers.get(resource, self.default_page_workers)
+
+    def header(self, resource):
+        return extractors[resource]['header']
+
+    def resource_url(self, resource):
+        # Listing of a resource, restricted by its resource_filters (e.g. the ID range of a shard)
+        if resource in self.resource_filters:
+            return self.client.list_url(resource) + '&' + self.resource_filters[resource]
+        return self.client.list_url(resource)
+
+    def bulk_extractor(self, resource):
+        # The hosts are only extracted as a whole with the 'script' strategy
+        if resource == 'hosts' and self.hosts_strategy != 'script':
+            return None
+        return extractors[resource].get('bulk')
+
+    def get_lookup(self, name):
+        with self.lookup_locks_guard:
+            lock = self.lookup_locks.setdefault(name, threading.Lock())
+        # Concurrent callers wait for the first one to load the data set
+        with lock:
+            if name not in self.lookups:
+                self.log('+ Loading ' + name + ' lookup table...')
+                self.lookups[name] = lookup_loaders[name](self)
+            return self.lookups[name]
+
+    def lookup_name(self, name, object_id):
+        # Falls back to the ID when the object is not visible (deleted meanwhile or no permission)
+        return self.get_lookup(name).get(object_id, str(object_id))
+
+    def pre_flight_check(self):
+        if self.capture_mode:
+            self.client.open_capture()
+
+        if self.capture_mode != 'replay' and not check_socket(self.controller_fqdn, self.controller_port):
+            raise ProfilerError(f'Controller {self.controller_fqdn} unreachable on port {self.controller_port} ! Exiting.', 14)
+
+        try:
+            req1 = self.client.get('/api/v2/ping')
+        except Exception:
+            raise ProfilerError("Controller API is not responding. Are you sure the controller address/FQDN is correct ?", 16)
         if req1.status_code > 299:
-            print(f"ERROR : Controller API is not responding. Are you sure the controller address/FQDN is correct ?")
-            exit(15)
-    except:
-        print(f"ERROR : Controller API is not responding. Are you sure the controller address/FQDN is correct ?")
-        exit(16)
+            raise ProfilerError("Controller API is not responding. Are you sure the controller address/FQDN is correct ?", 15)
 
-    req2 = requests.get(f"https://{controller_fqdn}/api/v2/me",auth=(controller_user, controller_pass), verify=False)
-    if int(req2.status_code) > 299 :
-        print(f"ERROR : User is not authorized. Please check the provided username and password !")
-        exit(17)
+        req2 = self.client.get('/api/v2/me')
+        if int(req2.status_code) > 299 :
+            raise ProfilerError("User is not authorized. Please check the provided username and password !", 17)
 
-    else:
         me = req2.json()
         if not me['results'][0]['is_superuser'] and not me['results'][0]['is_system_auditor']:
-            print('')
-            print('________________________________________________________________________________________________________________________________________________')
-            print(f'!!    WARNING : The user "{controller_user}" is not system administrator or system auditor. The script will probably NOT extract everything    !!')
-            print('________________________________________________________________________________________________________________________________________________')
-            print('')
-
-# Main
-all_possible_resources = ['credentials', 'projects', 'hosts', 'job_templates', 'inventories', 'inventory_sources', 'users', 'teams',  'roles', 'workflow_job_templates', 'host_metrics']
-
-pre_flight_check()
-
-results_dir = 'results_' + controller_fqdn.replace(".", "_").lower()
-controller_host = 'https://' + controller_fqdn + ':' + str(controller_port)
-
-now = datetime.now()
-print('')
-print('########################################################################################')
-print('###  STARTING EXTRACTION ')
-print('###  Controller = "'+ str(controller_host)+'"')
-print('###  Resource(s) to extract = '+str(resources_to_extract))
-print('###  Date = ' + str(now))
-print('########################################################################################')
-print('')
-
-# Create results directory if it does not exist
-resultDirExist = os.path.exists(results_dir)
-if not resultDirExist:
-    os.makedirs(results_dir)
-
-class Logger(object):
-    def __init__(self):
-        self.terminal = sys.stdout
-        self.log = open(results_dir+"/extraction.log", "a")
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        # this flush method is needed for python 3 compatibility.
-        # this handles the flush command by doing nothing.
-        pass
-
-
-sys.stdout = Logger()
-
-headers = {
-            'projects': 'Project ID;Organization;Project Name;Credential;Creator;Last Modified by',
-            'hosts': 'Host ID;Organization;Inventory;Hostname;ansible_host;ansible_ssh_host',
-            'credentials': 'Credential ID;Organization;Credential Name;Kind;Creator;Last Modified by',
-            'job_templates': 'Job Template ID;Organization;Job Template Name;Project;Credentials;Inventory;limit;Creator;Last Modified by',
-            'roles': 'Role ID;Object Type;Object Name;Role;Users;Teams',
-            'inventories': 'Inventory ID;Organization;Inventory Name;Created By;Last Modified by;Inventory Kind;Total Hosts;Total Groups;Host Filter;Has Inventory Source;Inventory Sources Details',
-            'users': 'User ID;Username;First Name;Last Name;Teams;Orgs;LDAP DN;Superuser',
-            'teams': 'Team ID;Team Name;Organization;Users',
-            'inventory_sources': 'Organization;Source Name;Source Type;Parent Inventory;Source Project;Source Credentials',
-            'workflow_job_templates': 'Workflow ID;Organization;Workflow Name;Inventory;limit;Creator;Last Modified by',
-            'host_metrics': 'host metric ID;hostname;automated_counter;deleted_counter;deleted;first_automation;last_automation;last_deleted;used_in_inventories;url'
-        }
-
-for resource in resources_to_extract:
-
-    r = requests.get(controller_host + '/api/v2/' + resource + '?page=1&page_size=' + str(page_size),
-                     auth=(controller_user, controller_pass), verify=False)
-    page1 = r.json()
-    count = page1['count']
-
-    pages_count = count // page_size + bool(count % page_size)
-
-    print('+ Extracting ' + resource + '....')
-    print('+ There is a total of ' + str(count) + ' ' + resource + ' in ' + str(pages_count) + ' page(s) ! Extracting it all ...')
-
-    f = open(results_dir + '/' + resource + '.csv', "w")
-    f.write(headers[resource] + "\n")
-
-    for x in range(1, (pages_count + 1)):
-        getattr(sys.modules[__name__], "extract_%s" % resource)(f, x)
-
-    print('+ ' + resource.upper() + " extraction complete. Results stored in : " + f.name)
-    f.close()
-    print('______________________________________________________________________________________________')
-
-
-now = datetime.now()
-print('')
-print('########################################################################################')
-print('###  EXTRACTION COMPLETE ')
-print('###  Controller = "'+ str(controller_host)+'"')
-print('###  Results directory = "' + results_dir + '"')
-print('###  Extracted Resource(s) = '+str(resources_to_extract))
-print('###  Date = ' + str(now))
-print('########################################################################################')
-print('')
+            self.log('', logging.WARNING)
+            self.log('________________________________________________________________________________________________________________________________________________', logging.WARNING)
+            self.log(f'!!    WARNING : The user "{self.controller_user}" is not system administrator or system auditor. The script will probably NOT extract everything    !!', logging.WARNING)
+            self.log('________________________________________________________________________________________________________________________________________________', logging.WARNING)
+            self.log('', logging.WARNING)
+
+        if self.use_token_auth and not self.controller_token and self.capture_mode != 'replay':
+            self.client.create_token()
+
+    def extract_page(self, resource, pages_count, item):
+        # Extract one page in memory, the rows are written to the csv file by the caller in page order.
+        # The page is fetched here when only its number is known.
+        n, page_n = item
+        self.debug("++ Page " + str(n) + ' / ' + str(pages_count) + ' of ' + resource + '...')
+        if page_n is None:
+            page_n = self.client.get_json(self.resource_url(resource) + '&page=' + str(n))
+        buffer = io.StringIO()
+        start = time.monotonic()
+        extractors[resource]['page'](self, buffer, page_n)
+        self.metrics.add_time('render_time', time.monotonic() - start)
+        last_id = page_n['results'][-1]['id'] if page_n['results'] else None
+        return n, last_id, buffer.getvalue()
+
+    def partition_filter(self, resource):
+        # resource_filters without their ordering, ID ranges are always listed by ID
+        query = self.resource_filters.get(resource, '')
+        return ''.join('&' + part for part in query.split('&') if part and not part.startswith('order_by='))
+
+    def id_partitions(self, resource, after=None):
+        # ID ranges (lower bound excluded, upper bound included) covering the listing, from the first ID (or the one
+        # after 'after' when resuming) to the last one when the extraction starts.
+        url = '/api/v2/' + resource + '/?page_size=1' + self.partition_filter(resource)
+        first = self.client.get_json(url + '&order_by=id')['results']
+        last = self.client.get_json(url + '&order_by=-id')['results']
+        if not first:
+            return list()
+        lower = first[0]['id'] - 1 if after is None else after
+        top = last[0]['id']
+        return [(low, min(low + self.jobs_partition_size, top)) for low in range(lower, top, self.jobs_partition_size)]
+
+    def extract_partition(self, resource, partitions_count, item):
+        # Extract one ID range in memory, with the same result as extract_page. The range is listed by ID windows,
+        # its upper bound is returned as last ID so that a resumed run skips the empty ranges too.
+        n, (lower, upper) = item
+        self.debug("++ Partition " + str(n) + ' / ' + str(partitions_count) + ' of ' + resource + ' (IDs ' + str(lower + 1) + ' to ' + str(upper) + ')...')
+        url = '/api/v2/' + resource + '/?page_size=' + str(self.page_size) + '&order_by=id&id__lte=' + str(upper) + self.partition_filter(resource)
+        buffer = io.StringIO()
+        last_id = lower
+        while True:
+            if self.stopping.is_set():
+                raise ExtractionStopped()
+            page = self.client.get_json(self.client.after_id(url, last_id))
+            start = time.monotonic()
+            extractors[resource]['page'](self, buffer, page)
+            self.metrics.add_time('render_time', time.monotonic() - start)
+            if not page['results'] or not page.get('next'):
+                break
+            last_id = page['results'][-1]['id']
+        return n, upper, buffer.getvalue()
+
+    def load_state(self):
+        # Run state kept between runs in the results directory
+        if os.path.exists(self.results_dir + '/state.json'):
+            with open(self.results_dir + '/state.json') as state_file:
+                return json.load(state_file)
+        return dict()
+
+    def save_state(self):
+        # The temporary file is written and renamed under the lock, resources finishing together take turns
+        with self.state_lock:
+            with open(self.results_dir + '/state.json.tmp', 'w') as state_file:
+                json.dump(self.state, state_file, indent=2)
+            os.replace(self.results_dir + '/state.json.tmp', self.results_dir + '/state.json')
+
+    def save_incremental_state(self, resource, started):
+        # Resources extracted at the same time update the state one after the other
+        with self.state_lock:
+            self.state.setdefault('incremental', dict())[resource] = started
+        self.save_state()
+
+    def server_time(self):
+        # Controller clock, so that the next modified__gt filter does not depend on the clock of this machine.
+        # A small overlap is kept, objects fetched twice are merged by ID anyway.
+        req = self.client.get('/api/v2/ping/')
+        now = parsedate_to_datetime(req.headers['Date']) - timedelta(seconds=60)
+        return now.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def deleted_ids(self, resource, ids):
+        # Count queries on chunks of IDs, only the chunks where something disappeared are listed
+        deleted = set()
+        ids = sorted(ids, key=int)
+        for i in range(0, len(ids), 100):
+            chunk = ids[i:i + 100]
+            url = '/api/v2/' + resource + '/?id__in=' + ','.join(chunk)
+            if self.client.get_json(url + '&page_size=1')['count'] == len(chunk):
+                continue
+            existing = {str(obj['id']) for obj in self.client.paginate(url + '&page_size=100')}
+            deleted.update(object_id for object_id in chunk if object_id not in existing)
+        return deleted
+
+    def extract_incremental(self, resource, file_path, since):
+        rows = read_rows(file_path)
+        url = self.client.list_url(resource) + '&modified__gt=' + since
+
+        page1 = self.client.get_json(url)
+        pages_count = page1['count'] // self.page_size + bool(page1['count'] % self.page_size)
+        self.log('+ ' + str(page1['count']) + ' ' + resource + ' modified since ' + since + ' in ' + str(pages_count) + ' page(s).')
+
+        changed = dict()
+        pages = enumerate(self.client.iter_pages(url, page1), 1) if page1['count'] else []
+        extract_page = lambda item: self.extract_page(resource, pages_count, item)
+        for n, last_id, text in ordered_map(extract_page, pages, self.workers(resource), self.stopping):
+            for line in text.splitlines(keepends=True):
+                changed[line.split(';', 1)[0]] = line
+
+        # When the total count matches, nothing was deleted since the previous run
+        total = self.client.get_json('/api/v2/' + resource + '/?page_size=1')['count']
+        known = set(rows) | set(changed)
+        deleted = set()
+        if total != len(known):
+            deleted = self.deleted_ids(resource, set(rows) - set(changed))
+
+        self.log('+ ' + str(len(changed)) + ' ' + resource + ' added or modified, ' + str(len(deleted)) + ' deleted.')
+        rows.update(changed)
+        for object_id in deleted:
+            del rows[object_id]
+
+        self.write_rows(resource, file_path, rows)
+
+    def write_rows(self, resource, file_path, rows):
+        # Rewrite a csv file from rows keyed by ID, in ID order
+        with open(file_path + '.tmp', 'w') as f:
+            f.write(self.header(resource) + "\n")
+            for object_id in sorted(rows, key=int):
+                f.write(rows[object_id])
+        os.replace(file_path + '.tmp', file_path)
+
+    def read_activity_stream(self, cursors, new_cursor=None):
+        # Returns the IDs of the objects touched since the cursor of each resource, per resource, and the new cursor.
+        # The new cursor is read before the extraction starts so that no event is missed on the next run, a resumed
+        # run reuses the one of the interrupted run.
+        if new_cursor is None:
+            last = self.client.get_json('/api/v2/activity_stream/?order_by=-id&page_size=1')['results']
+            new_cursor = last[0]['id'] if last else 0
+        changes = dict()
+        if not cursors:
+            return changes, new_cursor
+
+        cursor = min(cursors.values())
+        url = self.client.list_url('activity_stream') + '&order_by=id&id__gt=' + str(cursor) + '&id__lte=' + str(new_cursor)
+        events = 0
+        for event in self.client.paginate(url):
+            events += 1
+            # create/update/delete touch object1, associate/disassociate both objects. Every object of a tracked
+            # type linked to the event is refreshed, e.g. a user added to a team touches the user, the team and
+            # the team member role.
+            touched = [(self.activity_stream_types[object_type], str(obj['id'])) for object_type, objects in event['summary_fields'].items()
+                       if object_type in self.activity_stream_types for obj in objects]
+            if event['operation'] == 'delete' and event['object1'] in self.activity_stream_types and 'id' in event['changes']:
+                touched.append((self.activity_stream_types[event['object1']], str(event['changes']['id'])))
+            # Events already applied to a resource by a previous run are skipped
+            for resource, object_id in touched:
+                if event['id'] > cursors.get(resource, new_cursor):
+                    changes.setdefault(resource, set()).add(object_id)
+            if event['operation'] == 'delete' and event['object1'] in self.role_owner_types and event['id'] > cursors.get('roles', new_cursor):
+                self.role_owners_deleted = True
+
+        self.log('+ ' + str(events) + ' activity stream event(s) since event ' + str(cursor) + ' : ' + ', '.join(
+            [str(len(ids)) + ' ' + res for res, ids in changes.items()]))
+        return changes, new_cursor
+
+    def from_activity_stream(self, resource):
+        # Resource refreshed from the activity stream instead of being extracted again
+        return resource in self.stream_cursors
+
+    def extract_changes(self, resource, file_path, object_ids):
+        # Re-fetch the touched objects only and merge them into the previous csv file.
+        # Objects that no longer exist (or roles without members anymore) simply disappear from the file.
+        rows = read_rows(file_path)
+        for object_id in object_ids:
+            rows.pop(object_id, None)
+
+        if resource == 'roles' and self.role_owners_deleted:
+            # The roles of a deleted object go away with it, the remaining roles are checked with count queries
+            deleted = self.deleted_ids('roles', rows)
+            for object_id in deleted:
+                del rows[object_id]
+            self.log('+ ' + str(len(deleted)) + ' role(s) of deleted objects removed.')
+
+        ids = sorted(object_ids, key=int)
+        for i in range(0, len(ids), 100):
+            buffer = io.StringIO()
+            for page in self.client.iter_pages(self.client.list_url(resource) + '&id__in=' + ','.join(ids[i:i + 100])):
+                extractors[resource]['page'](self, buffer, page)
+            for line in buffer.getvalue().splitlines(keepends=True):
+                rows[line.split(';', 1)[0]] = line
+
+        self.log('+ ' + str(len(object_ids)) + ' ' + resource + ' refreshed from the activity stream.')
+        self.write_rows(resource, file_path, rows)
+
+    def read_checkpoints(self):
+        # Last journal entry of every resource : either {'done': True} or the last page written with the csv file size
+        checkpoints = dict()
+        if os.path.exists(self.results_dir + '/checkpoint.journal'):
+            with open(self.results_dir + '/checkpoint.journal') as journal_file:
+                for line in journal_file:
+                    # A line cut by the interruption is ignored
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    checkpoints[entry['resource']] = entry
+        return checkpoints
+
+    def checkpoint(self, entry):
+        with self.journal_lock:
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+
+    def resource_lookups(self, resource):
+        # Lookup tables needed before extracting a resource, a resource finished by the interrupted run needs none
+        if self.checkpoints.get(resource, dict()).get('done'):
+            return list()
+        # The hosts only use the organizations names with get_hosts_org_name
+        if resource == 'hosts' and not self.get_hosts_org_name:
+            return list()
+        # Resources refreshed from the activity stream only fetch the touched objects and their own sub-collections
+        if self.from_activity_stream(resource):
+            return list()
+        return extractors[resource]['lookups']
+
+    def run_node(self, node):
+        kind, name = node
+        if kind == 'lookup':
+            current_resource.set('lookup:' + name)
+            self.get_lookup(name)
+        else:
+            current_resource.set(name)
+            start = time.monotonic()
+            self.extract_resource(name)
+            self.durations[name] = time.monotonic() - start
+
+    def resource_graph(self):
+        # Dependency graph of the resources to extract and of the lookup tables they need : node -> nodes it waits for
+        graph = dict()
+        for resource in self.resources_to_extract:
+            graph[('resource', resource)] = [('lookup', name) for name in self.resource_lookups(resource)]
+        needed = [name for resource in self.resources_to_extract for name in self.resource_lookups(resource)]
+        while needed:
+            name = needed.pop()
+            if ('lookup', name) not in graph:
+                graph[('lookup', name)] = [('lookup', dependency) for dependency in lookup_dependencies.get(name, list())]
+                needed += lookup_dependencies.get(name, list())
+        return graph
+
+    def extract_resources(self):
+        # The resources and the lookup tables they share form a dependency graph. Every lookup table is loaded once,
+        # as soon as the tables it is built from are ready, and every resource starts as soon as its lookup tables
+        # are loaded. Up to resource_workers nodes run at the same time, the API requests of all of them go through
+        # the same concurrency governor.
+        graph = self.resource_graph()
+
+        # Lookup tables first as they unblock resources, then the longest resources, then the requested order
+        def priority(node):
+            kind, name = node
+            if kind == 'lookup':
+                return 0, 0
+            if name in self.long_resources:
+                return 1, self.long_resources.index(name)
+            return 2, self.resources_to_extract.index(name)
+
+        done = set()
+        running = dict()
+        executor = ThreadPoolExecutor(max_workers=self.resource_workers)
+        try:
+            while graph or running:
+                ready = sorted([node for node, dependencies in graph.items() if all(d in done for d in dependencies)], key=priority)
+                for node in ready[:self.resource_workers - len(running)]:
+                    del graph[node]
+                    running[executor.submit(self.run_node, node)] = node
+                finished, unfinished = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    future.result()
+                    done.add(node)
+        except BaseException:
+            # An error or Ctrl-C stops the run : the nodes not started are cancelled and the running ones
+            # stop at their next page, without being marked as done in the journal
+            self.stopping.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def extract_resource(self, resource):
+        csv_path = self.results_dir + '/' + resource + '.csv'
+        resumed = self.checkpoints.get(resource)
+        if resumed and resumed.get('done'):
+            self.log('+ ' + resource.upper() + ' already extracted by the interrupted run. Skipping.')
+            self.log('______________________________________________________________________________________________')
+            return
+
+        if self.from_activity_stream(resource):
+            self.log('+ Extracting ' + resource + ' changes from the activity stream....')
+            self.extract_changes(resource, csv_path, self.changes.get(resource, set()))
+            self.checkpoint({'resource': resource, 'done': True})
+            self.log('+ ' + resource.upper() + " extraction complete. Results stored in : " + csv_path)
+            self.log('______________________________________________________________________________________________')
+            return
+
+        started = None
+        if self.incremental and resource in self.incremental_resources:
+            # A full scan resumed after an interruption keeps the time it was first started at (stored with its pages)
+            started = resumed['started'] if resumed and 'started' in resumed else self.server_time()
+            since = self.state.get('incremental', dict()).get(resource)
+            if since and not resumed and os.path.exists(csv_path):
+                self.log('+ Extracting ' + resource + ' incrementally....')
+                self.extract_incremental(resource, csv_path, since)
+                self.save_incremental_state(resource, started)
+                self.checkpoint({'resource': resource, 'done': True})
+                self.log('+ ' + resource.upper() + " extraction complete. Results stored in : " + csv_path)
+                self.log('______________________________________________________________________________________________')
+                return
+
+        self.log('+ Extracting ' + resource + '....')
+        bulk_extractor = self.bulk_extractor(resource)
+        if resumed and not bulk_extractor and os.path.exists(csv_path):
+            # Rows written after the last checkpoint are dropped, they will be extracted again
+            f = open(csv_path, "r+")
+            f.truncate(resumed['offset'])
+            f.seek(resumed['offset'])
+            self.log('+ Resuming ' + resource + ' after page ' + str(resumed['page']) + ' (last ID ' + str(resumed['last_id']) + ').')
+        else:
+            resumed = None
+            f = open(csv_path, "w")
+            f.write(self.header(resource) + "\n")
+
+        self.start_progress(resource, resumed['page'] if resumed else 0)
+        if bulk_extractor:
+            bulk_extractor(self, f)
+        else:
+            workers = self.workers(resource)
+            written_ids = None
+            if extractors[resource]['partitioned']:
+                # Long histories are split in ID ranges scanned in parallel, rows are still written in ID order
+                partitions = self.id_partitions(resource, resumed['last_id'] if resumed else None)
+                self.log('+ Scanning ' + resource + ' in ' + str(len(partitions)) + ' ID range(s) of ' + str(self.jobs_partition_size) + ' ...')
+                first = resumed['page'] + 1 if resumed else 1
+                pages = enumerate(partitions, first)
+                units, total = 'ID range', first - 1 + len(partitions)
+                extract = lambda item: self.extract_partition(resource, total, item)
+            else:
+                page1 = self.client.get_json(self.resource_url(resource))
+                count = page1['count']
+
+                pages_count = count // self.page_size + bool(count % self.page_size)
+                self.log('+ There is a total of ' + str(count) + ' ' + resource + ' in ' + str(pages_count) + ' page(s) ! Extracting it all ...')
+
+                # The first page is reused, then the next links are followed (or the pages are fetched by number in parallel)
+                if not count:
+                    pages = []
+                elif resumed and self.pagination_mode == 'keyset':
+                    url = self.client.after_id(self.resource_url(resource), resumed['last_id'])
+                    pages = enumerate(self.client.iter_pages(url), resumed['page'] + 1)
+                elif resumed:
+                    # Pages fetched by number shift when objects are created or deleted meanwhile : the rows already
+                    # written are skipped, but an object moved to an earlier page is missed (keyset mode resumes exactly)
+                    with open(csv_path) as previous:
+                        next(previous)
+                        written_ids = {line.split(';', 1)[0] for line in previous}
+                    pages = [(n, None) for n in range(resumed['page'] + 1, pages_count + 1)]
+                elif workers > 1 and self.pagination_mode == 'page':
+                    pages = [(1, page1)] + [(n, None) for n in range(2, pages_count + 1)]
+                else:
+                    pages = enumerate(self.client.iter_pages(self.resource_url(resource), page1), 1)
+
+                units, total = 'page', pages_count
+                extract = lambda item: self.extract_page(resource, pages_count, item)
+
+            aggregates = None
+            if self.jobs_aggregates and resource in self.aggregated_resources:
+                aggregates = dict()
+                if resumed:
+                    # Rows kept from the interrupted run
+                    with open(csv_path) as previous:
+                        next(previous)
+                        aggregate_jobs(aggregates, previous)
+
+            written = 0
+            for n, last_id, rows in ordered_map(extract, pages, workers, self.stopping):
+                if written_ids:
+                    rows = ''.join(line for line in rows.splitlines(keepends=True) if line.split(';', 1)[0] not in written_ids)
+                start = time.monotonic()
+                f.write(rows)
+                f.flush()
+                self.metrics.add_time('write_time', time.monotonic() - start)
+                written += rows.count('\n')
+                self.progress(resource, n, total, written, units)
+                if aggregates is not None:
+                    aggregate_jobs(aggregates, rows.splitlines())
+                if last_id is not None:
+                    entry = {'resource': resource, 'page': n, 'last_id': last_id, 'offset': f.tell()}
+                    if started:
+                        entry['started'] = started
+                    self.checkpoint(entry)
+
+            if aggregates is not None:
+                write_jobs_aggregates(self.results_dir + '/' + resource + '_by_template.csv', aggregates)
+                self.log('+ ' + str(len(aggregates)) + ' template(s) in ' + self.results_dir + '/' + resource + '_by_template.csv')
+
+        self.log('+ ' + resource.upper() + " extraction complete. Results stored in : " + f.name)
+        f.close()
+        if started:
+            self.save_incremental_state(resource, started)
+        self.checkpoint({'resource': resource, 'done': True})
+        self.log('______________________________________________________________________________________________')
+
+    def run(self):
+        # Returns a summary of the extraction : controller, results directory, duration and rows per resource
+        start = time.monotonic()
+        try:
+            self.pre_flight_check()
+
+            # Create results directory if it does not exist
+            os.makedirs(self.results_dir, exist_ok=True)
+            self.open_log(self.results_dir + "/extraction.log")
+
+            self.log('')
+            self.log('########################################################################################')
+            self.log('###  STARTING EXTRACTION ')
+            self.log('###  Controller = "'+ str(self.controller_host)+'"')
+            self.log('###  Resource(s) to extract = '+str(self.resources_to_extract))
+            self.log('###  Date = ' + str(datetime.now()))
+            self.log('########################################################################################')
+            self.log('')
+
+            self.state = self.load_state()
+
+            # Checkpoint journal, an extraction started from scratch forgets the previous one
+            self.checkpoints = self.read_checkpoints() if self.resume else dict()
+            self.journal = open(self.results_dir + '/checkpoint.journal', "a" if self.resume else "w")
+
+            if self.change_capture:
+                # Every resource has its own cursor : a resource without one (never extracted with change_capture,
+                # or by a version keeping a single cursor), without its previous csv file or whose full extraction
+                # is being resumed is fully extracted
+                cursors = self.state.get('activity_stream')
+                cursors = cursors if isinstance(cursors, dict) else dict()
+                self.stream_cursors = {resource: cursors[resource] for resource in self.resources_to_extract
+                                       if resource in cursors and os.path.exists(self.results_dir + '/' + resource + '.csv')
+                                       and not self.checkpoints.get(resource)}
+                self.changes, stream_cursor = self.read_activity_stream(self.stream_cursors, self.checkpoints.get('activity_stream', dict()).get('cursor'))
+                self.checkpoint({'resource': 'activity_stream', 'cursor': stream_cursor})
+
+            if self.resource_workers > 1:
+                self.extract_resources()
+            else:
+                for resource in self.resources_to_extract:
+                    self.run_node(('resource', resource))
+
+            if self.change_capture:
+                with self.state_lock:
+                    cursors = self.state.get('activity_stream')
+                    cursors = cursors if isinstance(cursors, dict) else dict()
+                    for resource in self.resources_to_extract:
+                        if resource in self.activity_stream_types.values():
+                            cursors[resource] = stream_cursor
+                    self.state['activity_stream'] = cursors
+                self.save_state()
+
+            # The extraction is complete, nothing to resume
+            self.journal.close()
+            self.journal = None
+            os.remove(self.results_dir + '/checkpoint.journal')
+
+            self.write_performance_report(time.monotonic() - start)
+
+            self.log('')
+            self.log('########################################################################################')
+            self.log('###  EXTRACTION COMPLETE ')
+            self.log('###  Controller = "'+ str(self.controller_host)+'"')
+            self.log('###  Results directory = "' + self.results_dir + '"')
+            self.log('###  Extracted Resource(s) = '+str(self.resources_to_extract))
+            if self.durations:
+                longest = max(self.durations, key=self.durations.get)
+                self.log('###  Duration = ' + str(round(time.monotonic() - start, 1)) + 's (longest resource : ' + longest + ', ' + str(round(self.durations[longest], 1)) + 's)')
+            self.log('###  Date = ' + str(datetime.now()))
+            self.log('########################################################################################')
+            self.log('')
+        except BaseException:
+            self.stopping.set()
+            # The report of an interrupted run shows where it was spending its time
+            if self.log_file:
+                self.write_performance_report(time.monotonic() - start)
+            raise
+        finally:
+            self.close()
+
+        rows = {resource: count_rows(self.results_dir + '/' + resource + '.csv') for resource in self.resources_to_extract}
+        return {'controller': self.controller_fqdn, 'results_dir': self.results_dir,
+                'duration': round(time.monotonic() - start, 1), 'rows': rows}
+
+    def write_performance_report(self, duration):
+        # performance.json in the results directory and a short summary in the log
+        rows = {resource: count_rows(self.results_dir + '/' + resource + '.csv') for resource in self.resources_to_extract
+                if os.path.exists(self.results_dir + '/' + resource + '.csv')}
+        report = self.metrics.report(rows, duration)
+        with open(self.results_dir + '/performance.json', 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.log('+ Performance : ' + str(report['requests']) + ' API request(s), ' + str(round(report['bytes'] / 1048576.0, 1)) + ' MB in ' + str(report['duration']) + 's')
+        for resource, entry in report['resources'].items():
+            self.log('++ ' + resource + ' : ' + str(entry['requests']) + ' request(s), ' + str(entry['retries']) + ' retry(ies), ' + str(
+                entry['latency_total']) + 's waiting for the API, ' + str(entry['parse_time']) + 's parsing JSON, ' + str(
+                entry.get('render_time', 0)) + 's rendering rows, ' + str(entry.get('write_time', 0)) + 's writing')
+            for family, endpoint in list(entry['endpoints'].items())[:3]:
+                self.log('+++ ' + family + ' : ' + str(endpoint['requests']) + ' request(s), p50 ' + str(endpoint['latency']['p50']) + 's, p95 ' + str(
+                    endpoint['latency']['p95']) + 's, p99 ' + str(endpoint['latency']['p99']) + 's')
+            for family, endpoint in entry['endpoints'].items():
+                if endpoint.get('n_plus_one'):
+                    self.log('+++ N+1 : ' + family + ' requested for ' + str(endpoint['parents']) + ' ' + resource + ' parent object(s) (' + str(
+                        endpoint['requests_per_parent']) + ' request(s) each)')
+        self.log('+ Performance report stored in : ' + self.results_dir + '/performance.json')
+
+    def sample_listing(self, url):
+        # First page of a listing with its latency and size in bytes, kept for the other estimates
+        if url not in self.samples:
+            start = time.monotonic()
+            response, page = self.client.request(url, True)
+            self.samples[url] = {'count': page['count'], 'results': page['results'], 'latency': time.monotonic() - start,
+                                 'bytes': len(response.content)}
+        return self.samples[url]
+
+    def estimate_listing(self, url, workers=1):
+        # Requests of a whole listing, one per page, estimated from its first page
+        sample = self.sample_listing(url)
+        pages = max(1, -(-sample['count'] // self.page_size))
+        return {'endpoint': endpoint_family(url), 'objects': sample['count'], 'requests': pages,
+                'bytes': max(sample['bytes'], sample['count'] * sample['bytes'] // max(1, len(sample['results']))),
+                'latency': sample['latency'], 'workers': workers}
+
+    def estimate_sub_collection(self, parent, path, parent_filter, workers_of):
+        # Requests of a sub-collection listed for every parent object, estimated from the sub-collections of
+        # estimate_samples parents spread over a random page of the parents listing
+        url = self.client.list_url(parent) + parent_filter
+        listing = self.sample_listing(url)
+        parents = listing['results']
+        pages = -(-listing['count'] // self.page_size)
+        if pages > 1:
+            page = random.randint(1, pages)
+            if page > 1:
+                parents = self.client.get_json(url + '&page=' + str(page))['results']
+        sampled = parents[::max(1, len(parents) // self.estimate_samples)][:self.estimate_samples]
+
+        requests = size = latency = objects = 0
+        for obj in sampled:
+            estimate = self.estimate_listing(self.client.list_url(parent + '/' + str(obj['id']) + '/' + path))
+            requests += estimate['requests']
+            size += estimate['bytes']
+            latency += estimate['latency'] * estimate['requests']
+            objects += estimate['objects']
+        count = max(1, len(sampled))
+        return {'endpoint': '/api/v2/' + parent + '/{id}/' + path + '/', 'parents': listing['count'],
+                'fan_out': round(objects / count, 2), 'requests': listing['count'] * requests // count,
+                'bytes': listing['count'] * size // count, 'latency': latency / max(1, requests),
+                'workers': self.workers(workers_of) if workers_of else 1}
+
+    def estimate_node(self, node):
+        # Requests of a resource or lookup table of the dependency graph (see resource_graph)
+        kind, name = node
+        if kind == 'lookup':
+            if name in self.fan_out:
+                return [self.estimate_sub_collection(*entry) for entry in self.fan_out[name]]
+            if name == 'inventory_sources_by_inventory':
+                return list()
+            if name == 'team_read_roles':
+                return [self.estimate_listing(self.client.list_url('teams'))]
+            return [self.estimate_listing(self.client.list_url(name))]
+
+        if name == 'hosts' and self.bulk_extractor(name):
+            # One inventory script per inventory having hosts, about as long and big as listing its hosts
+            inventories = self.estimate_listing(self.client.list_url('inventories'))
+            hosts = self.estimate_listing(self.client.list_url('hosts'))
+            sample = self.sample_listing(self.client.list_url('inventories'))['results']
+            with_hosts = len([inv for inv in sample if inv['kind'] != 'smart' and inv['total_hosts']]) / max(1, len(sample))
+            scripts = max(1, round(inventories['objects'] * with_hosts))
+            return [inventories, {'endpoint': '/api/v2/inventories/{id}/script/', 'objects': hosts['objects'], 'requests': scripts,
+                                  'bytes': hosts['bytes'], 'latency': hosts['latency'] * hosts['requests'] / scripts,
+                                  'workers': self.hosts_script_workers}]
+        if name == 'roles':
+            return ([self.estimate_listing(self.client.list_url('roles') + '&members__isnull=False')] +
+                    [self.estimate_sub_collection(*entry) for entry in self.fan_out['roles']])
+        if self.bulk_extractor(name):
+            # Extracted from lookup tables only
+            return list()
+
+        listing = self.estimate_listing(self.resource_url(name), self.workers(name))
+        if extractors[name]['partitioned']:
+            # The last page of every ID range and the two queries of its bounds
+            listing['requests'] += len(self.id_partitions(name)) + 2
+        return [listing]
+
+    def estimate(self):
+        # Dry run predicting the API calls, bytes and duration of a full extraction of the selected resources. Only the
+        # object counts, the first page of every listing and a sample of the sub-collections are requested. The
+        # duration assumes the latency of the sampled requests and the concurrency of the options (resource_workers,
+        # page workers and max_requests_in_flight), it is a lower bound when the controller slows down under load.
+        try:
+            self.pre_flight_check()
+            graph = self.resource_graph()
+            nodes = dict()
+            for node in sorted(graph, key=lambda node: node[0] == 'resource'):
+                current_resource.set(node[1] if node[0] == 'resource' else 'lookup:' + node[1])
+                requests = self.estimate_node(node)
+                nodes[node] = {'requests': sum(r['requests'] for r in requests), 'bytes': sum(r['bytes'] for r in requests),
+                               'duration': sum(r['requests'] * r['latency'] / min(r['workers'], self.max_requests_in_flight) for r in requests),
+                               'work': sum(r['requests'] * r['latency'] for r in requests), 'endpoints': requests}
+
+            # Nodes start when the nodes they wait for are done, and all share the max_requests_in_flight budget
+            finish = dict()
+            def finish_time(node):
+                if node not in finish:
+                    finish[node] = nodes[node]['duration'] + max([finish_time(d) for d in graph[node]] or [0])
+                return finish[node]
+            if self.resource_workers > 1:
+                duration = max(max(finish_time(node) for node in nodes), sum(n['work'] for n in nodes.values()) / self.max_requests_in_flight)
+            else:
+                duration = sum(n['duration'] for n in nodes.values())
+
+            report = {'controller': self.controller_fqdn, 'date': str(datetime.now()), 'requests': sum(n['requests'] for n in nodes.values()),
+                      'bytes': sum(n['bytes'] for n in nodes.values()), 'duration': round(duration, 1),
+                      'estimate_requests': self.metrics.report(dict(), 0)['requests'], 'resources': dict()}
+            self.log('')
+            self.log('+ Estimate of a full extraction of ' + str(self.resources_to_extract) + ' :')
+            for (kind, name), entry in sorted(nodes.items(), key=lambda n: -n[1]['duration']):
+                name = name if kind == 'resource' else 'lookup:' + name
+                for request in entry['endpoints']:
+                    request['latency'] = round(request['latency'], 4)
+                report['resources'][name] = {'requests': entry['requests'], 'bytes': entry['bytes'], 'duration': round(entry['duration'], 1),
+                                             'endpoints': entry['endpoints']}
+                self.log('++ ' + name + ' : ' + str(entry['requests']) + ' API call(s), ' + str(round(entry['bytes'] / 1048576.0, 1)) +
+                         ' MB, ' + str(round(entry['duration'], 1)) + 's')
+                for request in entry['endpoints']:
+                    detail = ' (' + str(request['fan_out']) + ' object(s) for each of ' + str(request['parents']) + ' parent(s))' if 'fan_out' in request else ''
+                    self.log('+++ ' + request['endpoint'] + ' : ' + str(request['requests']) + ' call(s)' + detail + ', ' +
+                             str(request['latency']) + 's per call, ' + str(request['workers']) + ' worker(s)')
+            self.log('+ Total : ' + str(report['requests']) + ' API call(s), ' + str(round(report['bytes'] / 1048576.0, 1)) + ' MB, about ' +
+                     str(timedelta(seconds=round(duration))) + ' (' + str(round(duration, 1)) + 's) with ' + str(self.resource_workers) + ' resource worker(s) and up to ' +
+                     str(self.max_requests_in_flight) + ' request(s) in flight (estimated with ' + str(report['estimate_requests']) + ' API call(s))')
+
+            os.makedirs(self.results_dir, exist_ok=True)
+            with open(self.results_dir + '/estimate.json', 'w') as f:
+                json.dump(report, f, indent=2)
+            self.log('+ Estimate stored in : ' + self.results_dir + '/estimate.json')
+            return report
+        finally:
+            self.close()
+
+    def plan_shards(self, shards):
+        # Splits the extraction in shards extracted by separate machines (see shard_config and merge_shards).
+        # Resources listed page by page are split in ID ranges holding the same number of objects, each boundary is
+        # read with a single page_size=1 query. Resources extracted as a whole go to one shard each.
+        try:
+            self.pre_flight_check()
+            plan = [{'resources_to_extract': list(), 'resource_filters': dict()} for n in range(shards)]
+            next_bulk_shard = shards - 1
+            for resource in self.resources_to_extract:
+                if self.bulk_extractor(resource):
+                    plan[next_bulk_shard]['resources_to_extract'].append(resource)
+                    next_bulk_shard = (next_bulk_shard - 1) % shards
+                    continue
+
+                count = self.client.get_json('/api/v2/' + resource + '/?page_size=1')['count']
+                bounds = list()
+                for k in range(1, shards):
+                    position = count * k // shards
+                    if position:
+                        page = self.client.get_json('/api/v2/' + resource + '/?order_by=id&page_size=1&page=' + str(position))
+                        if page['results'] and page['results'][0]['id'] not in bounds:
+                            bounds.append(page['results'][0]['id'])
+
+                # The first and last ranges are open, objects created meanwhile are not lost
+                lower = None
+                for n, upper in enumerate(bounds + [None]):
+                    query = 'order_by=id'
+                    if lower is not None:
+                        query += '&id__gt=' + str(lower)
+                    if upper is not None:
+                        query += '&id__lte=' + str(upper)
+                    plan[n]['resources_to_extract'].append(resource)
+                    plan[n]['resource_filters'][resource] = query
+                    lower = upper
+                self.log('+ ' + str(count) + ' ' + resource + ' split in ' + str(len(bounds) + 1) + ' shard(s).')
+
+            os.makedirs(self.results_dir, exist_ok=True)
+            manifest = {'controller_fqdn': self.controller_fqdn, 'controller_port': self.controller_port,
+                        'created': str(datetime.now()), 'shards': plan}
+            with open(self.results_dir + '/shards.json', 'w') as f:
+                json.dump(manifest, f, indent=2)
+            self.log('+ Shard manifest stored in : ' + self.results_dir + '/shards.json')
+            return self.results_dir + '/shards.json'
+        finally:
+            self.close()
+
+    def close(self):
+        self.client.close()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        self.close_log()
+
+
+def profile_controller(config):
+    # Fleet worker, runs in its own process. Errors are reported in the summary instead of stopping the fleet.
+    summary = {'controller': config.get('controller_fqdn'), 'status': 'complete', 'error': ''}
+    start = time.monotonic()
+    try:
+        summary.update(Profiler(config, quiet=True).run())
+    except ProfilerError as e:
+        summary.update({'status': 'failed', 'error': str(e), 'code': e.code})
+    except Exception as e:
+        summary.update({'status': 'failed', 'error': type(e).__name__ + ' : ' + str(e)})
+    summary.setdefault('duration', round(time.monotonic() - start, 1))
+    return summary
+
+
+def read_fleet(path, config):
+    # Fleet file : a JSON list of controllers, or {"defaults": {...}, "controllers": [...]}.
+    # Every controller is a dict of options (controller_fqdn, controller_pass, max_requests_in_flight...),
+    # completing the options given on the command line, in the environment and in the fleet defaults.
+    with open(path) as fleet_file:
+        fleet = json.load(fleet_file)
+    if isinstance(fleet, list):
+        fleet = {'controllers': fleet}
+    controllers = list()
+    for controller in fleet.get('controllers', list()):
+        controller_config = dict(config)
+        controller_config.update(fleet.get('defaults', dict()))
+        controller_config.update(controller)
+        controllers.append(controller_config)
+    if not controllers:
+        raise ProfilerError(f"Fleet file {path} does not list any controller !", 38)
+    return controllers
+
+
+def profile_fleet(controllers, workers, results_dir='results_fleet'):
+    # Every controller is profiled in its own process, with its own request limits and results_<fqdn> directory.
+    # A consolidated summary of all the controllers is written in results_dir.
+    print('+ Profiling ' + str(len(controllers)) + ' controller(s), ' + str(workers) + ' at a time...')
+    start = time.monotonic()
+    summaries = list()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(profile_controller, config) for config in controllers]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            if summary['status'] == 'complete':
+                print('+ ' + summary['controller'] + ' : extraction complete in ' + str(summary['duration']) + 's. Results stored in : ' + summary['results_dir'])
+            else:
+                print('+ ' + str(summary['controller']) + ' : extraction FAILED after ' + str(summary['duration']) + 's (' + summary['error'] + ')')
+
+    summaries.sort(key=lambda summary: str(summary['controller']))
+    os.makedirs(results_dir, exist_ok=True)
+    with open(results_dir + '/fleet_summary.json', 'w') as f:
+        json.dump(summaries, f, indent=2)
+    with open(results_dir + '/fleet_summary.csv', 'w') as f:
+        f.write('Controller;Status;Duration;Results Directory;' + ';'.join(all_possible_resources) + ';Error' + "\n")
+        for summary in summaries:
+            rows = summary.get('rows', dict())
+            f.write(str(summary['controller']) + ';' + summary['status'] + ';' + str(summary['duration']) + ';' + summary.get('results_dir', 'Null') + ';' + ';'.join(
+                [str(rows[resource]) if resource in rows else '' for resource in all_possible_resources]) + ';' + (summary['error'] or 'Null') + "\n")
+
+    failed = [summary for summary in summaries if summary['status'] != 'complete']
+    print('')
+    print('########################################################################################')
+    print('###  FLEET EXTRACTION COMPLETE ')
+    print('###  Controllers = ' + str(len(summaries)) + ' (' + str(len(failed)) + ' failed)')
+    print('###  Duration = ' + str(round(time.monotonic() - start, 1)) + 's')
+    print('###  Summary = "' + results_dir + '/fleet_summary.csv"')
+    print('########################################################################################')
+    print('')
+    return summaries
+
+
+def shard_config(path, shard):
+    # Options of one shard of a manifest made by Profiler.plan_shards(). The shard is extracted in the
+    # shard_<n> directory next to the manifest, copy it back there from the worker machine before merging.
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if not 1 <= shard <= len(manifest['shards']):
+        raise ProfilerError(f"Shard {shard} does not exist, the manifest {path} has {len(manifest['shards'])} shard(s) !", 42)
+    config = {'controller_fqdn': manifest['controller_fqdn'], 'controller_port': manifest['controller_port'],
+              'results_dir': (os.path.dirname(path) or '.') + '/shard_' + str(shard)}
+    config.update(manifest['shards'][shard - 1])
+    return config
+
+
+def merge_shards(path):
+    # Stitches the csv files of every shard into the results directory of the manifest. Shards hold disjoint ID ranges
+    # in ID order, so the files are merged in a single streaming pass.
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    base = os.path.dirname(path) or '.'
+    resources = list()
+    for shard in manifest['shards']:
+        resources += [resource for resource in shard['resources_to_extract'] if resource not in resources]
+
+    incomplete = [str(n) for n in range(1, len(manifest['shards']) + 1)
+                  if not os.path.isdir(base + '/shard_' + str(n)) or os.path.exists(base + '/shard_' + str(n) + '/checkpoint.journal')]
+    if incomplete:
+        raise ProfilerError(f"Shard(s) {', '.join(incomplete)} missing or not complete in {base} ! Run or resume them before merging.", 43)
+
+    for resource in resources:
+        paths = [base + '/shard_' + str(n) + '/' + resource + '.csv' for n, shard in enumerate(manifest['shards'], 1)
+                 if resource in shard['resources_to_extract']]
+        header = extractors[resource]['header']
+        files = [open(shard_path) for shard_path in paths]
+        try:
+            for f in files:
+                next(f)
+            # inventory_sources has no ID column, it is never split anyway
+            if header.split(';', 1)[0].lower().endswith('id'):
+                rows = heapq.merge(*files, key=lambda line: int(line.split(';', 1)[0]))
+            else:
+                rows = (line for f in files for line in f)
+            with open(base + '/' + resource + '.csv.tmp', 'w') as merged:
+                merged.write(header + "\n")
+                merged.writelines(rows)
+            os.replace(base + '/' + resource + '.csv.tmp', base + '/' + resource + '.csv')
+        finally:
+            for f in files:
+                f.close()
+        print('+ ' + resource.upper() + ' merged from ' + str(len(paths)) + ' shard(s). Results stored in : ' + base + '/' + resource + '.csv')
+
+
+def parse_option(name, value):
+    # Options given as strings (command line, environment) are converted to the type of their default value
+    default = DEFAULT_CONFIG[name]
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, list):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    if isinstance(default, dict):
+        # hosts=4,roles=2 or hosts=organization__name=Default
+        items = (item.split('=', 1) for item in value.split(',') if item.strip())
+        return {key.strip(): int(item) if item.strip().isdigit() else item.strip() for key, item in items}
+    if default is None:
+        return value or None
+    return value
+
+
+def environment_config(environ):
+    # Same variables as the AWX / AAP command line, then AAPROFILER_<OPTION> for every option
+    config = dict()
+    if environ.get('CONTROLLER_HOST'):
+        host = environ['CONTROLLER_HOST']
+        parts = urlsplit(host if '://' in host else 'https://' + host)
+        config['controller_fqdn'] = parts.hostname
+        if parts.port:
+            config['controller_port'] = parts.port
+    for name, variable in (('controller_user', 'CONTROLLER_USERNAME'), ('controller_pass', 'CONTROLLER_PASSWORD'),
+                           ('controller_token', 'CONTROLLER_OAUTH_TOKEN')):
+        if environ.get(variable):
+            config[name] = environ[variable]
+    for name in DEFAULT_CONFIG:
+        variable = 'AAPROFILER_' + name.upper()
+        if variable in environ:
+            try:
+                config[name] = parse_option(name, environ[variable])
+            except ValueError:
+                raise ProfilerError(f"{variable} has an invalid value '{environ[variable]}' !", 36)
+    return config
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description='Scrape an AWX or AAP Controller API and generate csv files reports.',
+                                     epilog='Every option can also be set with an AAPROFILER_<OPTION> environment variable, '
+                                            'e.g. AAPROFILER_PAGE_SIZE=100.')
+    parser.add_argument('--config', help='JSON file of options, e.g. {"controller_fqdn": "...", "page_workers": {"hosts": 8}}')
+    parser.add_argument('--fleet', help='JSON file listing several controllers to profile in parallel, e.g. '
+                                        '{"defaults": {"max_requests_in_flight": 4}, "controllers": [{"controller_fqdn": "...", '
+                                        '"controller_pass": "..."}]}. The other options apply to every controller')
+    parser.add_argument('--shards', type=int, help='Split the extraction of one controller in this number of shards and write '
+                                                   'the shard manifest (shards.json) in the results directory')
+    parser.add_argument('--shard-manifest', help='Shard manifest used by --shard and --merge-shards')
+    parser.add_argument('--shard', type=int, help='Extract this shard (1, 2...) of the --shard-manifest in shard_<n> next to it')
+    parser.add_argument('--merge-shards', action='store_true', help='Merge the extracted shards of the --shard-manifest '
+                                                                    'into csv files in ID order next to it')
+    parser.add_argument('--estimate', action='store_true', help='Only predict the API calls, bytes and duration of the extraction '
+                                                                '(estimate.json in the results directory), from the object counts '
+                                                                'and a sample of the pages and sub-collections')
+    parser.add_argument('--fleet-workers', type=int, default=4, help='Number of controllers profiled at the same time, '
+                                                                     'each in its own process (default: 4)')
+    for name, default, description in OPTIONS:
+        flag = '--' + name.replace('_', '-')
+        if isinstance(default, bool):
+            parser.add_argument(flag, dest=name, action='store_const', const=True, default=argparse.SUPPRESS,
+                                help=description + ' (default: ' + str(default) + ')')
+            parser.add_argument('--no-' + name.replace('_', '-'), dest=name, action='store_const', const=False,
+                                default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+        elif name == 'capture_mode':
+            parser.add_argument(flag, dest=name, choices=['record', 'replay'], default=argparse.SUPPRESS, help=description)
+        else:
+            option_type = lambda value, name=name: parse_option(name, value)
+            option_type.__name__ = name
+            parser.add_argument(flag, dest=name, type=option_type, default=argparse.SUPPRESS,
+                                help=description + ('' if default in ('', None) or name == 'controller_pass' else ' (default: ' + str(default) + ')'))
+    parser.add_argument('--record', dest='capture_mode', action='store_const', const='record', default=argparse.SUPPRESS,
+                        help='Same as --capture-mode record')
+    parser.add_argument('--replay', dest='capture_mode', action='store_const', const='replay', default=argparse.SUPPRESS,
+                        help='Same as --capture-mode replay')
+    return parser
+
+
+def main(argv=None):
+    # Defaults, then the --config file, the environment and the command line options
+    args = vars(argument_parser().parse_args(argv))
+    try:
+        config = dict()
+        config_path = args.pop('config', None)
+        fleet_path = args.pop('fleet', None)
+        fleet_workers = args.pop('fleet_workers')
+        shards = args.pop('shards', None)
+        shard_manifest = args.pop('shard_manifest', None)
+        shard = args.pop('shard', None)
+        merge = args.pop('merge_shards', False)
+        estimate = args.pop('estimate', False)
+        if config_path:
+            with open(config_path) as config_file:
+                config.update(json.load(config_file))
+        config.update(environment_config(os.environ))
+        config.update(args)
+        if (shard or merge) and not shard_manifest:
+            raise ProfilerError("--shard and --merge-shards need the --shard-manifest made with --shards !", 49)
+        if merge:
+            merge_shards(shard_manifest)
+        elif estimate:
+            Profiler(config).estimate()
+        elif shards is not None:
+            if shards < 2:
+                raise ProfilerError(f"shards should be an integer greater than 1 and not {shards} !", 50)
+            Profiler(config).plan_shards(shards)
+        elif shard:
+            # The controller and resources of the shard complete the other options
+            config = dict(config, **{name: value for name, value in shard_config(shard_manifest, shard).items()
+                                     if name not in ('controller_fqdn', 'controller_port') or name not in args})
+            Profiler(config).run()
+        elif fleet_path:
+            if fleet_workers < 1:
+                raise ProfilerError(f"fleet_workers should be a positive integer and not {fleet_workers} !", 39)
+            summaries = profile_fleet(read_fleet(fleet_path, config), fleet_workers)
+            if any(summary['status'] != 'complete' for summary in summaries):
+                return 40
+        else:
+            Profiler(config).run()
+    except ProfilerError as e:
+        print('ERROR : ' + str(e))
+        return e.code
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
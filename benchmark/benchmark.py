@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+'''
+ Benchmark of aaprofiler.py against the fake controller of fake_controller.py.
+
+ Every resource is extracted by its own aaprofiler.py process, so that the peak memory (RSS) of each resource
+ is measured separately. Options which are not benchmark options are given to aaprofiler.py, which allows to
+ compare strategies on the same dataset. The results are printed and saved in a JSON file, and can be compared
+ with the results of a previous run to catch regressions.
+
+ Usage :
+   ./benchmark/benchmark.py --resources hosts,users,roles --hosts 1000000 --users 50000 --roles 200000 --latency 0.02
+   ./benchmark/benchmark.py --resources hosts --hosts-strategy script --output script.json --baseline pages.json
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from fake_controller import add_server_arguments, start_server
+
+
+AAPROFILER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'aaprofiler.py')
+
+DEFAULT_RESOURCES = ['credentials', 'projects', 'hosts', 'job_templates', 'inventories', 'inventory_sources', 'users', 'teams',
+                     'roles', 'workflow_job_templates', 'host_metrics', 'jobs', 'workflow_jobs']
+
+
+def count_rows(path):
+    # Rows of a csv file, without the header
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return max(0, sum(1 for line in f) - 1)
+
+
+def run_resource(server, resource, work_dir, profiler_args):
+    # Extract one resource in a separate process and measure it
+    results_dir = os.path.join(work_dir, resource)
+    command = [sys.executable, AAPROFILER, '--controller-fqdn', 'localhost', '--controller-port', str(server.server_address[1]),
+               '--controller-pass', 'benchmark', '--resources-to-extract', resource, '--results-dir', results_dir] + profiler_args
+    calls = server.calls
+    start = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this process only
+    pid, status, usage = os.wait4(process.pid, 0)
+    duration = time.monotonic() - start
+    calls = server.calls - calls
+
+    rows = count_rows(os.path.join(results_dir, resource + '.csv'))
+    return {'resource': resource, 'exit_code': os.waitstatus_to_exitcode(status), 'duration': round(duration, 2),
+            'api_calls': calls, 'requests_per_second': round(calls / duration, 1), 'rows': rows,
+            'rows_per_second': round(rows / duration, 1), 'peak_rss_mb': round(usage.ru_maxrss / 1024.0, 1)}
+
+
+def print_results(results, baseline):
+    columns = ['resource', 'exit_code', 'duration', 'api_calls', 'requests_per_second', 'rows', 'rows_per_second', 'peak_rss_mb']
+    titles = ['Resource', 'Exit', 'Seconds', 'API calls', 'Requests/s', 'Rows', 'Rows/s', 'Peak RSS (MB)']
+    if baseline:
+        columns.append('rows_per_second_change')
+        titles.append('Rows/s vs baseline')
+    lines = [titles] + [[str(result.get(column, '')) for column in columns] for result in results]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print('  '.join(value.ljust(width) for value, width in zip(line, widths)))
+
+
+def compare(results, baseline, tolerance):
+    # Flag the resources whose rows/s dropped by more than the tolerance (percent) compared with the baseline
+    previous = {result['resource']: result for result in baseline['results']}
+    regressions = list()
+    for result in results:
+        before = previous.get(result['resource'])
+        if not before or not before['rows_per_second']:
+            continue
+        change = 100.0 * (result['rows_per_second'] - before['rows_per_second']) / before['rows_per_second']
+        result['rows_per_second_change'] = ('+' if change >= 0 else '') + str(round(change, 1)) + '%'
+        if change < -tolerance:
+            regressions.append(result['resource'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark aaprofiler.py against a fake controller. Options not listed below '
+                                                 'are given to aaprofiler.py (e.g. --pagination-mode keyset)')
+    parser.add_argument('--resources', default=','.join(DEFAULT_RESOURCES), help='Comma separated list of the resources to benchmark')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results (default: benchmark.json)')
+    parser.add_argument('--baseline', default='', help='Results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='Rows/s drop (percent) compared with the baseline reported as a regression (default: 10)')
+    parser.add_argument('--work-dir', default='', help='Directory of the extracted csv files, a temporary directory removed '
+                                                       'at the end by default')
+    add_server_arguments(parser)
+    args, profiler_args = parser.parse_known_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    server = start_server(args)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='aaprofiler_benchmark_')
+    print('Fake controller on port ' + str(server.server_address[1]) + ' : ' +
+          ', '.join(str(size) + ' ' + table for table, size in server.dataset.sizes.items()))
+    print('Latency ' + str(args.latency) + 's, error rate ' + str(args.error_rate) + ', aaprofiler.py options : ' + ' '.join(profiler_args))
+
+    results = list()
+    try:
+        for resource in args.resources.split(','):
+            print('Benchmarking ' + resource + '...', flush=True)
+            results.append(run_resource(server, resource, work_dir, profiler_args))
+    finally:
+        server.shutdown()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    print()
+    print_results(results, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump({'sizes': server.dataset.sizes, 'latency': args.latency, 'error_rate': args.error_rate,
+                   'profiler_args': profiler_args, 'results': results}, f, indent=2)
+    print()
+    print('Results stored in : ' + args.output)
+
+    if any(result['exit_code'] for result in results):
+        print('ERROR : the extraction of ' + ', '.join(r['resource'] for r in results if r['exit_code']) + ' failed')
+        return 1
+    if regressions:
+        print('ERROR : rows/s regression of more than ' + str(args.tolerance) + '% for ' + ', '.join(regressions))
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
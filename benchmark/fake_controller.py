@@ -0,0 +1,436 @@
+#!/usr/bin/python3
+'''
+ Stand-in AWX / AAP Controller API used to benchmark aaprofiler.py without a real controller.
+
+ Serves the /api/v2 endpoints read by the profiler (ping, me, tokens, paged listings, sub-collections, object
+ details and inventory scripts) over HTTPS from a synthetic dataset. Objects are computed from their ID when they
+ are requested, so a dataset of millions of hosts costs no memory. Latency and errors can be injected.
+
+ Usage :
+   ./benchmark/fake_controller.py --port 8443 --hosts 1000000 --users 50000 --roles 200000 --latency 0.05
+   ../aaprofiler.py --controller-fqdn localhost --controller-port 8443 --controller-pass benchmark
+'''
+
+import os
+import sys
+import json
+import ssl
+import time
+import random
+import argparse
+import threading
+import tempfile
+import subprocess
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+
+# Number of objects of every table, the defaults give a medium size controller
+DEFAULT_SIZES = {
+    'organizations': 10,
+    'inventories': 100,
+    'hosts': 100000,
+    'users': 5000,
+    'teams': 500,
+    'roles': 20000,
+    'credentials': 200,
+    'projects': 200,
+    'job_templates': 1000,
+    'workflow_job_templates': 100,
+    'inventory_sources': 100,
+    'host_metrics': 100000,
+    'jobs': 50000,
+    'workflow_jobs': 5000,
+}
+
+# Object N was created and last modified N seconds after this date
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# Query parameters which do not filter the objects
+NOT_FILTERS = ('page', 'page_size', 'order_by', 'hostvars', 'towervars', 'all')
+
+# Every tenth role has direct user members (members__isnull=False), every tenth role + 5 is granted to a team
+ROLES_STEP = 10
+
+
+def timestamp(object_id):
+    return datetime.fromtimestamp(EPOCH.timestamp() + object_id, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def seconds_since_epoch(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() - EPOCH.timestamp()
+
+
+class Dataset(object):
+    # Synthetic controller content. Memberships are arithmetic so that every listing is a range of IDs :
+    #  - host H is in inventory (H - 1) % inventories + 1, user U in team (U - 1) % teams + 1 and organization (U - 1) % organizations + 1
+    #  - roles 10, 20, 30... have 3 users (10 and 20 are System Administrator and System Auditor), roles 15, 25, 35... one team
+
+    def __init__(self, **sizes):
+        self.sizes = dict(DEFAULT_SIZES)
+        self.sizes.update({name: size for name, size in sizes.items() if size is not None})
+        self.builders = {'organizations': self.organization, 'inventories': self.inventory, 'hosts': self.host, 'users': self.user,
+                         'teams': self.team, 'roles': self.role, 'credentials': self.credential, 'projects': self.project,
+                         'job_templates': self.job_template, 'workflow_job_templates': self.workflow_job_template,
+                         'inventory_sources': self.inventory_source, 'host_metrics': self.host_metric, 'jobs': self.job,
+                         'workflow_jobs': self.workflow_job}
+
+    def size(self, table):
+        return self.sizes[table]
+
+    def cycle(self, object_id, table):
+        return (object_id - 1) % self.sizes[table] + 1
+
+    def organization(self, i):
+        return {'id': i, 'name': 'org-' + str(i), 'modified': timestamp(i)}
+
+    def organization_ref(self, i):
+        return {'id': i, 'name': 'org-' + str(i)}
+
+    def audit(self, i):
+        return {'created_by': {'username': 'admin'}, 'modified_by': {'username': 'user' + str(self.cycle(i, 'users'))}}
+
+    def inventory(self, i):
+        org = self.cycle(i, 'organizations')
+        summary = {'organization': self.organization_ref(org)}
+        summary.update(self.audit(i))
+        return {'id': i, 'name': 'inventory-' + str(i), 'organization': org, 'kind': '', 'host_filter': None,
+                'has_inventory_sources': i <= self.sizes['inventory_sources'], 'total_hosts': len(self.inventory_hosts(i)),
+                'total_groups': 1, 'modified': timestamp(i), 'summary_fields': summary}
+
+    def inventory_hosts(self, i):
+        return range(i, self.sizes['hosts'] + 1, self.sizes['inventories'])
+
+    def host_variables(self, h):
+        if h % 3 == 0:
+            return {'ansible_host': '10.' + str(h // 65536 % 256) + '.' + str(h // 256 % 256) + '.' + str(h % 256)}
+        if h % 3 == 1:
+            return {'ansible_ssh_host': 'host' + str(h) + '.example.com'}
+        return {}
+
+    def host(self, h):
+        inventory = self.cycle(h, 'inventories')
+        variables = self.host_variables(h)
+        if h % 3 == 0:
+            # YAML variables
+            variables = '\n'.join(key + ': ' + value for key, value in variables.items())
+        else:
+            variables = json.dumps(variables) if variables else ''
+        return {'id': h, 'name': 'host' + str(h) + '.example.com', 'variables': variables, 'inventory': inventory,
+                'modified': timestamp(h),
+                'summary_fields': {'inventory': {'id': inventory, 'name': 'inventory-' + str(inventory),
+                                                 'organization_id': self.cycle(inventory, 'organizations')}}}
+
+    def user(self, u):
+        return {'id': u, 'username': 'user' + str(u), 'first_name': 'First' + str(u) if u % 2 else '', 'last_name': 'Last' + str(u),
+                'ldap_dn': 'cn=user' + str(u) + ',dc=example,dc=com' if u % 5 == 0 else '', 'is_superuser': u == 1,
+                'is_system_auditor': False, 'modified': timestamp(u)}
+
+    def team(self, t):
+        org = self.cycle(t, 'organizations')
+        return {'id': t, 'name': 'team-' + str(t), 'organization': org, 'modified': timestamp(t),
+                'summary_fields': {'organization': self.organization_ref(org)}}
+
+    def role(self, r):
+        if r == ROLES_STEP:
+            return {'id': r, 'name': 'System Administrator', 'summary_fields': {}}
+        if r == 2 * ROLES_STEP:
+            return {'id': r, 'name': 'System Auditor', 'summary_fields': {}}
+        return {'id': r, 'name': ['Admin', 'Use', 'Read', 'Execute', 'Update'][r % 5],
+                'summary_fields': {'resource_name': 'project-' + str(self.cycle(r, 'projects')), 'resource_type': 'project',
+                                   'resource_type_display_name': 'Project', 'resource_id': self.cycle(r, 'projects')}}
+
+    def role_users(self, r):
+        if r % ROLES_STEP:
+            return []
+        return sorted({(r * 7 + k * 13) % self.sizes['users'] + 1 for k in range(3)})
+
+    def role_teams(self, r):
+        if r % ROLES_STEP != ROLES_STEP // 2:
+            return []
+        return [self.cycle(r // ROLES_STEP + 1, 'teams')]
+
+    def team_roles(self, t):
+        return range(ROLES_STEP * (t - 1) + ROLES_STEP // 2, self.sizes['roles'] + 1, ROLES_STEP * self.sizes['teams'])
+
+    def credential(self, i):
+        summary = {'organization': self.organization_ref(self.cycle(i, 'organizations')), 'credential_type': {'name': 'Machine'}}
+        summary.update(self.audit(i))
+        return {'id': i, 'name': 'credential-' + str(i), 'organization': self.cycle(i, 'organizations'), 'modified': timestamp(i),
+                'summary_fields': summary}
+
+    def project(self, i):
+        credential = self.cycle(i, 'credentials') if i % 2 else None
+        summary = {'organization': self.organization_ref(self.cycle(i, 'organizations')),
+                   'credential': {'name': 'credential-' + str(credential)}}
+        summary.update(self.audit(i))
+        return {'id': i, 'name': 'project-' + str(i), 'organization': self.cycle(i, 'organizations'), 'credential': credential,
+                'modified': timestamp(i), 'summary_fields': summary}
+
+    def job_template(self, i):
+        inventory, project, credential = self.cycle(i, 'inventories'), self.cycle(i, 'projects'), self.cycle(i, 'credentials')
+        summary = {'organization': {'name': 'org-' + str(self.cycle(i, 'organizations'))}, 'project': {'name': 'project-' + str(project)},
+                   'inventory': {'name': 'inventory-' + str(inventory)}, 'credentials': [{'name': 'credential-' + str(credential)}]}
+        summary.update(self.audit(i))
+        return {'id': i, 'name': 'job-template-' + str(i), 'organization': self.cycle(i, 'organizations'), 'project': project,
+                'inventory': inventory, 'limit': 'group' + str(i % 4) if i % 4 else '', 'modified': timestamp(i), 'summary_fields': summary}
+
+    def workflow_job_template(self, i):
+        return {'id': i, 'name': 'workflow-' + str(i), 'organization': self.cycle(i, 'organizations'),
+                'inventory': self.cycle(i, 'inventories') if i % 2 else None, 'limit': None, 'modified': timestamp(i),
+                'summary_fields': self.audit(i)}
+
+    def inventory_source(self, i):
+        inventory = self.cycle(i, 'inventories')
+        scm = i % 2 == 1
+        project = self.cycle(i, 'projects') if scm else None
+        return {'id': i, 'name': 'source-' + str(i), 'source': 'scm' if scm else 'ec2', 'inventory': inventory,
+                'source_project': project, 'modified': timestamp(i),
+                'summary_fields': {'inventory': {'name': 'inventory-' + str(inventory)},
+                                   'organization': {'name': 'org-' + str(self.cycle(inventory, 'organizations'))},
+                                   'source_project': {'name': 'project-' + str(project)} if scm else None,
+                                   'credentials': [{'name': 'credential-' + str(self.cycle(i, 'credentials')), 'kind': 'scm' if scm else 'aws'}]}}
+
+    def host_metric(self, i):
+        return {'id': i, 'hostname': 'host' + str(i) + '.example.com', 'automated_counter': i % 100, 'first_automation': timestamp(i),
+                'last_automation': timestamp(i), 'deleted_counter': 0, 'deleted': False, 'last_deleted': None,
+                'used_in_inventories': None, 'url': '/api/v2/host_metrics/' + str(i) + '/'}
+
+    def job(self, i):
+        template = self.cycle(i, 'job_templates')
+        inventory, project = self.cycle(template, 'inventories'), self.cycle(template, 'projects')
+        return {'id': i, 'name': 'job-template-' + str(template), 'job_template': template, 'unified_job_template': template,
+                'status': 'failed' if i % 7 == 0 else 'successful', 'failed': i % 7 == 0, 'launch_type': 'scheduled' if i % 3 else 'manual',
+                'created': timestamp(i), 'started': timestamp(i), 'finished': timestamp(i), 'elapsed': float(i % 600),
+                'inventory': inventory, 'project': project,
+                'summary_fields': {'job_template': {'id': template, 'name': 'job-template-' + str(template)},
+                                   'organization': {'name': 'org-' + str(self.cycle(template, 'organizations'))},
+                                   'inventory': {'name': 'inventory-' + str(inventory)}, 'project': {'name': 'project-' + str(project)}}}
+
+    def workflow_job(self, i):
+        template = self.cycle(i, 'workflow_job_templates')
+        return {'id': i, 'name': 'workflow-' + str(template), 'workflow_job_template': template, 'unified_job_template': template,
+                'status': 'failed' if i % 11 == 0 else 'successful', 'failed': i % 11 == 0, 'launch_type': 'scheduled',
+                'created': timestamp(i), 'started': timestamp(i), 'finished': timestamp(i), 'elapsed': float(i % 1800),
+                'summary_fields': {'workflow_job_template': {'id': template, 'name': 'workflow-' + str(template)},
+                                   'organization': {'name': 'org-' + str(self.cycle(template, 'organizations'))}}}
+
+    def sub_collection(self, table, object_id, path):
+        # (IDs, builder) of /api/v2/<table>/<id>/<path>/, None when not served
+        sizes = self.sizes
+        collections = {
+            ('teams', 'users'): lambda: (range(object_id, sizes['users'] + 1, sizes['teams']), self.user),
+            ('users', 'teams'): lambda: ([self.cycle(object_id, 'teams')], self.team),
+            ('organizations', 'users'): lambda: (range(object_id, sizes['users'] + 1, sizes['organizations']), self.user),
+            ('organizations', 'admins'): lambda: ([object_id] if object_id <= sizes['users'] else [], self.user),
+            ('users', 'organizations'): lambda: ([self.cycle(object_id, 'organizations')], self.organization),
+            ('roles', 'users'): lambda: (self.role_users(object_id), self.user),
+            ('roles', 'teams'): lambda: (self.role_teams(object_id), self.team),
+            ('teams', 'roles'): lambda: (self.team_roles(object_id), self.role),
+            ('inventories', 'hosts'): lambda: (self.inventory_hosts(object_id), self.host),
+            ('inventories', 'inventory_sources'): lambda: (range(object_id, sizes['inventory_sources'] + 1, sizes['inventories']),
+                                                           self.inventory_source),
+        }
+        if (table, path) not in collections:
+            return None
+        return collections[(table, path)]()
+
+    def listing(self, table):
+        ids = range(1, self.sizes[table] + 1)
+        return ids, self.builders[table]
+
+    def script(self, inventory):
+        # /api/v2/inventories/<id>/script/?hostvars=1
+        hostvars = dict()
+        for h in self.inventory_hosts(inventory):
+            variables = self.host_variables(h)
+            variables['remote_tower_id'] = h
+            hostvars['host' + str(h) + '.example.com'] = variables
+        return {'all': {'hosts': list(hostvars)}, '_meta': {'hostvars': hostvars}}
+
+
+def filter_ids(ids, query, table):
+    # Apply the query filters to a sorted sequence of IDs (a range stays a range, so filters cost O(log n))
+    lower, upper = 0, None
+    for key, value in query.items():
+        if key in NOT_FILTERS:
+            continue
+        if key == 'id__gt':
+            lower = max(lower, int(value))
+        elif key == 'id__lte':
+            upper = int(value) if upper is None else min(upper, int(value))
+        elif key in ('modified__gt', 'created__gt'):
+            lower = max(lower, int(seconds_since_epoch(value)))
+        elif key == 'created__gte':
+            lower = max(lower, -int(-seconds_since_epoch(value) // 1) - 1)
+        elif key == 'created__lt':
+            bound = -int(-seconds_since_epoch(value) // 1) - 1
+            upper = bound if upper is None else min(upper, bound)
+        elif key == 'members__isnull' and table == 'roles' and value == 'False':
+            ids = ids[ROLES_STEP - 1::ROLES_STEP]
+        elif key == 'id__in':
+            wanted = sorted({int(i) for i in value.split(',') if i})
+            ids = [i for i in wanted if bisect_left(ids, i) < len(ids) and ids[bisect_left(ids, i)] == i]
+        else:
+            raise ValueError('Filter ' + key + ' is not supported by the fake controller')
+    ids = ids[bisect_right(ids, lower):]
+    if upper is not None:
+        ids = ids[:bisect_right(ids, upper)]
+    return ids
+
+
+class FakeControllerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.count_call()
+        self.send(201, {'id': 1, 'token': 'benchmark-token'})
+
+    def do_DELETE(self):
+        self.server.count_call()
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.count_call()
+        if server.latency:
+            time.sleep(max(0.0, random.uniform(server.latency - server.jitter, server.latency + server.jitter)))
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send(random.choice([500, 502, 503]), {'detail': 'Injected error'})
+
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = [part for part in url.path.split('/') if part][2:]
+        dataset = server.dataset
+
+        if path == ['ping']:
+            return self.send(200, {'ha': False, 'version': 'benchmark', 'active_node': 'localhost'})
+        if path == ['me']:
+            if 'Authorization' not in self.headers:
+                return self.send(401, {'detail': 'Authentication credentials were not provided.'})
+            return self.send(200, {'count': 1, 'next': None, 'previous': None, 'results': [dataset.user(1)]})
+        if path == ['activity_stream']:
+            collection = range(0), None
+        elif not path or path[0] not in dataset.sizes or len(path) > 1 and not path[1].isdigit():
+            collection = None
+        elif len(path) == 1:
+            collection = dataset.listing(path[0])
+        elif not 1 <= int(path[1]) <= dataset.size(path[0]):
+            collection = None
+        elif len(path) == 2:
+            return self.send(200, dataset.builders[path[0]](int(path[1])))
+        elif path[0] == 'inventories' and path[2:] == ['script']:
+            return self.send(200, dataset.script(int(path[1])))
+        else:
+            collection = dataset.sub_collection(path[0], int(path[1]), path[2])
+        if collection is None:
+            return self.send(404, {'detail': 'Not found.'})
+        ids, builder = collection
+
+        try:
+            ids = filter_ids(ids, query, path[0])
+        except ValueError as e:
+            return self.send(400, {'detail': str(e)})
+        if query.get('order_by') == '-id':
+            ids = ids[::-1]
+
+        page = int(query.get('page', 1))
+        page_size = min(200, int(query.get('page_size', 25)))
+        if page < 1 or page > 1 and (page - 1) * page_size >= len(ids):
+            return self.send(404, {'detail': 'Invalid page.'})
+        next_url = None
+        if page * page_size < len(ids):
+            next_url = url.path + '?' + urlencode(dict(query, page=page + 1))
+        previous_url = url.path + '?' + urlencode(dict(query, page=page - 1)) if page > 1 else None
+        results = [builder(i) for i in ids[(page - 1) * page_size:page * page_size]]
+        self.send(200, {'count': len(ids), 'next': next_url, 'previous': previous_url, 'results': results})
+
+
+class FakeController(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, dataset, certfile, keyfile, latency=0.0, jitter=0.0, error_rate=0.0):
+        super(FakeController, self).__init__(('127.0.0.1', port), FakeControllerHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = min(jitter, latency)
+        self.error_rate = error_rate
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    def count_call(self):
+        with self.calls_lock:
+            self.calls += 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def make_certificate(directory):
+    # Self-signed certificate of the fake controller (the profiler does not verify certificates)
+    certfile, keyfile = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    if not os.path.exists(certfile):
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30', '-subj', '/CN=localhost',
+                        '-keyout', keyfile, '-out', certfile], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def add_server_arguments(parser):
+    for table, size in DEFAULT_SIZES.items():
+        parser.add_argument('--' + table.replace('_', '-'), type=int, default=size, metavar='N',
+                            help='Number of ' + table + ' (default: ' + str(size) + ')')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency (seconds) added to every GET request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random variation (seconds) of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of the GET requests answered with a 5xx error')
+    parser.add_argument('--cert-dir', default='', help='Directory of cert.pem and key.pem, created with openssl when missing '
+                                                      '(a temporary directory by default)')
+
+
+def start_server(args, port=0):
+    # Fake controller configured from the arguments of add_server_arguments(), served in a background thread
+    certfile, keyfile = make_certificate(args.cert_dir or tempfile.mkdtemp(prefix='aaprofiler_benchmark_'))
+    dataset = Dataset(**{table: getattr(args, table) for table in DEFAULT_SIZES})
+    server = FakeController(port, dataset, certfile, keyfile, args.latency, args.jitter, args.error_rate)
+    server.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake AWX / AAP Controller API serving a synthetic dataset')
+    parser.add_argument('--port', type=int, default=8443, help='HTTPS port (default: 8443)')
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    server = start_server(args, args.port)
+    print('Fake controller listening on https://localhost:' + str(server.server_address[1]) + ' with ' +
+          ', '.join(str(size) + ' ' + table for table, size in server.dataset.sizes.items()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())